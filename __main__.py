@@ -3,8 +3,15 @@ import os
 import re
 import time
 
+from src.cache import RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL
+from src.checkpoints import CHECKPOINT_PATH, CheckpointStore
+from src.gsheets import ZillowScraperGsheets
+from src.metrics import metrics
+from src.profiling import RunProfile
+from src.sinks import LAYOUTS, WRITERS
+from src.snapshots import SNAPSHOT_PATH
 from src.util import EMAIL_REGEX
-from src.zillow_scraper import ZillowScraperCsv, ZillowScraperGsheets
+from src.zillow_scraper import ZillowScraperCsv
 
 
 def parse_args():
@@ -12,6 +19,93 @@ def parse_args():
     # required inputs
     parser.add_argument('zip_codes', nargs='+', help='zip code(s) to search')
     parser.add_argument('--verbose', action='store_true', help='verbose')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=1,
+        help='number of result pages to fetch at the same time')
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=1.0,
+        help='max page requests per second')
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=3.0,
+        help='max random delay in seconds added to each page request')
+    parser.add_argument(
+        '--zip-workers',
+        type=int,
+        default=1,
+        help='number of zip codes to scrape at the same time')
+    parser.add_argument(
+        '--parse-workers',
+        type=int,
+        default=None,
+        help='number of parser processes used with --zip-workers')
+    parser.add_argument(
+        '--retry-budget',
+        type=int,
+        default=50,
+        help='max retries of failed page requests for the whole run')
+    parser.add_argument(
+        '--rotate-identity',
+        action='store_true',
+        help='reset the tor identity when zillow throttles us')
+    parser.add_argument(
+        '--cache-ttl',
+        type=int,
+        default=RESPONSE_CACHE_TTL,
+        help='seconds to reuse downloaded pages, 0 disables the cache')
+    parser.add_argument(
+        '--cache-path',
+        default=RESPONSE_CACHE_PATH,
+        help='sqlite file of the page cache')
+    parser.add_argument(
+        '--since-last',
+        action='store_true',
+        help='only output listings that are new, removed or changed since '
+             'the last --since-last run. Paging stops at the first page '
+             'without changes, removals are only found when every page is '
+             'scanned, which is forced every FULL_SCAN_INTERVAL seconds '
+             '(default a week)')
+    parser.add_argument(
+        '--snapshot-path',
+        default=SNAPSHOT_PATH,
+        help='sqlite file of listings seen by --since-last runs')
+    parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help='save every scraped page to --checkpoint-path so an interrupted '
+             'run can be resumed')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='resume an interrupted --checkpoint run of the same zip codes, '
+             'finished zip codes and pages come from the checkpoint; implies '
+             '--checkpoint')
+    parser.add_argument(
+        '--checkpoint-path',
+        default=CHECKPOINT_PATH,
+        help='sqlite file of the pages scraped so far')
+    parser.add_argument(
+        '--metrics',
+        action='store_true',
+        help='print a json line with the time spent in every stage')
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='cProfile the run, print the hot functions and save the stats '
+             'for pstats/snakeviz to --profile-path')
+    parser.add_argument(
+        '--profile-path',
+        default='zillow.prof',
+        help='file the --profile stats are saved to')
+    parser.add_argument(
+        '--profile-memory',
+        action='store_true',
+        help='with --profile, also list the top tracemalloc allocations')
 
     # subparsers
     subparsers = parser.add_subparsers(dest='save_option', help='save option')
@@ -19,6 +113,21 @@ def parse_args():
 
     local_parser = subparsers.add_parser('local', help='save outputs locally')
     local_parser.add_argument('--outdir', help='output dir', required=True)
+    local_parser.add_argument(
+        '--format',
+        dest='output_format',
+        choices=sorted(WRITERS),
+        default='csv',
+        help='output file format')
+    local_parser.add_argument(
+        '--layout',
+        choices=LAYOUTS,
+        default='single',
+        help='one file, one file per zip code or a partitioned dataset')
+    local_parser.add_argument(
+        '--append',
+        action='store_true',
+        help='append to the output of earlier runs')
 
     web_parser = subparsers.add_parser('web', help='save outputs to gsheets')
     web_parser.add_argument(
@@ -34,11 +143,47 @@ if __name__ == "__main__":
     for zip_code in args.zip_codes:
         assert len(zip_code) == 5, 'invalid zip code argument {}'.format(zip_code)
 
+    checkpoints = None
+    if args.checkpoint or args.resume:
+        checkpoints = CheckpointStore(
+            args.checkpoint_path,
+            scope='since_last' if args.since_last else '')
+    fetch_options = dict(concurrency=args.concurrency,
+                         rate=args.rate,
+                         jitter=args.jitter,
+                         zip_workers=args.zip_workers,
+                         parse_workers=args.parse_workers,
+                         retry_budget=args.retry_budget,
+                         rotate_identity=args.rotate_identity,
+                         cache_ttl=args.cache_ttl,
+                         cache_path=args.cache_path,
+                         since_last=args.since_last,
+                         snapshot_path=args.snapshot_path,
+                         checkpoints=checkpoints,
+                         resume=args.resume)
     if args.save_option == 'local':
-        zsearch = ZillowScraperCsv(args.zip_codes, args.outdir, args.verbose)
+        zsearch = ZillowScraperCsv(
+            args.zip_codes,
+            args.outdir,
+            args.verbose,
+            output_format=args.output_format,
+            layout=args.layout,
+            append=args.append,
+            **fetch_options)
     elif args.save_option == 'web':
         match = re.match(EMAIL_REGEX, args.email)
         if not match:
             raise Exception('Invalid email type')
-        zsearch = ZillowScraperGsheets(args.zip_codes, args.email, args.verbose)
-    zsearch.scrape()
+        zsearch = ZillowScraperGsheets(
+            args.zip_codes, args.email, args.verbose, **fetch_options)
+    if args.metrics:
+        metrics.enabled = True
+    if args.profile:
+        with RunProfile(args.profile_path,
+                        trace_memory=args.profile_memory) as run_profile:
+            zsearch.scrape()
+        run_profile.print_report()
+    else:
+        zsearch.scrape()
+    if args.metrics:
+        metrics.log_summary(zip_codes=args.zip_codes)
@@ -1,12 +1,17 @@
 import flask
 import os
-import rq
+import re
 import rq_dashboard
 from decouple import config
 
 import worker
-from src.zillow_scraper import ZillowScraperGsheets
-from src.zillow_scraper import scrape_zillow_zipcode
+from src.jobs import batch_status, enqueue_batch, enqueue_zipcode, job_status
+from src.jobs import queue_timings, schedule_sheet_pool_refill, stream_listings
+from src.metrics import METRICS_ENABLED, prometheus_text
+from src.sheet_pool import SheetPool
+from src.util import EMAIL_REGEX
+
+ZIP_CODE_REGEX = re.compile(r'^\d{5}$')
 
 
 def check_auth(username, password):
@@ -41,8 +46,6 @@ app.config['REDIS_URL'] = config('REDIS_URL', 'localhost')
 rq_dashboard.blueprint.before_request(basic_auth)
 app.register_blueprint(rq_dashboard.blueprint, url_prefix="/rq")
 
-worker_queue = rq.Queue(connection=worker.connection, is_async=True)
-
 
 @app.route('/')
 def ecf():
@@ -51,16 +54,119 @@ def ecf():
         status='OK')
 
 
+@app.route('/sheet-pool')
+def sheet_pool():
+    auth_error = basic_auth()
+    if auth_error:
+        return auth_error
+    pool = SheetPool(worker.connection)
+    schedule_sheet_pool_refill(pool)
+    return flask.jsonify(**pool.stats())
+
+
+@app.route('/stats/queues')
+def queue_stats():
+    auth_error = basic_auth()
+    if auth_error:
+        return auth_error
+    return flask.jsonify(**queue_timings(worker.connection))
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not METRICS_ENABLED:
+        flask.abort(404)
+    auth_error = basic_auth()
+    if auth_error:
+        return auth_error
+    return flask.Response(prometheus_text(worker.connection),
+                          mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/jobs/<job_id>')
+def job_progress(job_id):
+    status = job_status(worker.connection, job_id)
+    if status is None:
+        flask.abort(404)
+    return flask.jsonify(**status)
+
+
+@app.route('/zipcodes/<zipcode>/listings')
+def zipcode_listings(zipcode):
+    """ Listings as they are parsed, as ndjson or with ?format=sse as
+    server-sent events. The last line tells if the scrape is done, a cut off
+    stream is resumed with ?start= set to its "next". """
+    start = max(flask.request.args.get('start', 0, type=int), 0)
+    listings = stream_listings(worker.connection, zipcode, start=start)
+    if flask.request.args.get('format') == 'sse':
+        lines = ('data: {}\n\n'.format(line) for line in listings)
+        mimetype = 'text/event-stream'
+    else:
+        lines = (line + '\n' for line in listings)
+        mimetype = 'application/x-ndjson'
+    return flask.Response(flask.stream_with_context(lines), mimetype=mimetype)
+
+
+@app.route('/batch', methods=['POST'])
+def ecf_batch():
+    """ {"zip_codes": [...], "email": ...}: one spreadsheet for all zip codes """
+    request = flask.request.get_json(silent=True)
+    if not isinstance(request, dict):
+        return flask.jsonify(status='INVALID_REQUEST',
+                             error='expected a json object'), 400
+    zip_codes = request.get('zip_codes')
+    email = request.get('email')
+    if not isinstance(zip_codes, list) or not zip_codes:
+        return flask.jsonify(status='INVALID_REQUEST',
+                             error='zip_codes must be a non-empty list of '
+                                   'zip code strings'), 400
+    if not isinstance(email, str) or not re.match(EMAIL_REGEX, email):
+        return flask.jsonify(status='INVALID_REQUEST',
+                             error='invalid email'), 400
+    invalid = [zip_code for zip_code in zip_codes
+               if not isinstance(zip_code, str)
+               or not ZIP_CODE_REGEX.match(zip_code)]
+    if invalid:
+        return flask.jsonify(status='INVALID_REQUEST',
+                             error='invalid zip codes',
+                             invalid_zip_codes=invalid), 400
+    try:
+        batch_id, jobs = enqueue_batch(worker.connection, zip_codes, email)
+    except ValueError as e:
+        return flask.jsonify(status='INVALID_REQUEST', error=str(e)), 400
+    return flask.jsonify(batch_id=batch_id,
+                         email=email,
+                         jobs={zip_code: job.id for zip_code, job in jobs.items()
+                               if job is not None},
+                         status_url=flask.url_for('batch_progress',
+                                                  batch_id=batch_id),
+                         status='PROCESSING_REQUEST'), 202
+
+
+@app.route('/batches/<batch_id>')
+def batch_progress(batch_id):
+    status = batch_status(worker.connection, batch_id)
+    if status is None:
+        flask.abort(404)
+    return flask.jsonify(**status)
+
+
 @app.route('/<zipcode>/<email>')
 def ecf_zipcode(zipcode, email):
-    worker_queue.enqueue(
-        scrape_zillow_zipcode,
-        job_timeout='3m',
-        description='Scraping zipcode {} for {}'.format(
-            zipcode, email),
-        args=(zipcode, email))
+    if not ZIP_CODE_REGEX.match(zipcode) or not re.match(EMAIL_REGEX, email):
+        return flask.jsonify(zipcode=zipcode,
+                             email=email,
+                             status='INVALID_REQUEST'), 400
+    # ?profile=1 keeps a cProfile of the jobs in their meta, admins only
+    profile = flask.request.args.get('profile') == '1' and basic_auth() is None
+    job = enqueue_zipcode(worker.connection, zipcode, email, profile=profile)
     return flask.jsonify(zipcode=zipcode,
                          email=email,
+                         job_id=job.id if job else None,
+                         status_url=flask.url_for('job_progress', job_id=job.id)
+                         if job else None,
+                         listings_url=flask.url_for('zipcode_listings',
+                                                    zipcode=zipcode),
                          status='PROCESSING_REQUEST')
 
 
@@ -0,0 +1,135 @@
+""" Run every benchmark on the corpus and keep the results per commit
+
+Each run appends a json line to the results file and is compared with the
+last run of another commit, changes beyond the threshold are flagged.
+
+    python -m benchmarks.corpus generate
+    python -m benchmarks --results benchmarks/results.jsonl
+"""
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+
+from benchmarks import bench_parse, bench_properties, bench_scrape, bench_sinks
+from benchmarks import bench_startup
+from benchmarks.corpus import CORPUS_DIR
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'results.jsonl')
+# metrics where a bigger number is an improvement
+HIGHER_IS_BETTER = ('pages_per_second', 'listings_per_second', 'rows_per_second')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='corpus dir')
+    parser.add_argument('--results', default=RESULTS_PATH, help='results file')
+    parser.add_argument(
+        '--iterations',
+        type=int,
+        default=5,
+        help='passes over the corpus for the parse benchmark')
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=20000,
+        help='listings for the memory and sink benchmarks')
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.05,
+        help='simulated seconds per request of the scrape benchmark')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='relative change reported as a regression')
+    return parser.parse_args()
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_all(args):
+    """ Flat metric name -> value of every benchmark """
+    results = {}
+    texts = bench_parse.corpus_texts(args.corpus)
+    if not texts:
+        raise Exception('Empty corpus {}, run python -m benchmarks.corpus '
+                        'generate first'.format(args.corpus))
+    parse = bench_parse.run(texts, args.iterations)
+    results['parse.ms_per_page'] = parse['ms_per_page']
+    results['parse.pages_per_second'] = parse['pages_per_second']
+    results['parse.listings_per_second'] = parse['listings_per_second']
+    results['parse.peak_bytes'] = bench_parse.peak_memory(texts)
+
+    for name, (size, _) in bench_properties.run(args.rows).items():
+        results['memory.{}_bytes_per_listing'.format(name)] = size / args.rows
+
+    for output_format, (elapsed, _) in bench_sinks.run(args.rows).items():
+        results['sinks.{}.rows_per_second'.format(output_format)] = \
+            args.rows / elapsed
+
+    scrape = bench_scrape.run(args.corpus, latency=args.latency)
+    results['scrape.seconds'] = scrape['seconds']
+    results['scrape.pages_per_second'] = scrape['pages_per_second']
+
+    for name, ms in bench_startup.run().items():
+        results['startup.{}.ms'.format(name)] = ms
+    # includes the lxml trees tracemalloc can't see, kB on linux
+    results['process.max_rss_bytes'] = \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return results
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def compare(previous, results, threshold):
+    """ Yield (metric, old, new, change, is_regression) """
+    for name, value in sorted(results.items()):
+        old = previous['results'].get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        if name.endswith(HIGHER_IS_BETTER):
+            regression = change < -threshold
+        else:
+            regression = change > threshold
+        yield name, old, value, change, regression
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    commit = current_commit()
+    results = run_all(args)
+    runs = load_runs(args.results)
+    previous = [run for run in runs if run['commit'] != commit]
+    with open(args.results, 'a') as outfile:
+        outfile.write(json.dumps({
+            'commit': commit,
+            'date': datetime.datetime.now().isoformat(),
+            'results': results}, sort_keys=True) + '\n')
+
+    if not previous:
+        for name, value in sorted(results.items()):
+            print('{:45s} {:14.2f}'.format(name, value))
+    else:
+        print('compared with {}'.format(previous[-1]['commit']))
+        for name, old, value, change, regression in compare(
+                previous[-1], results, args.threshold):
+            print('{:45s} {:14.2f} {:14.2f} {:+7.1%}{}'.format(
+                name, old, value, change, '  REGRESSION' if regression else ''))
@@ -0,0 +1,86 @@
+""" Time page parsing on saved zillow search pages
+
+Pages can be saved with the response_path option of get_response, without
+pages the whole benchmark corpus is parsed.
+
+    python -m benchmarks.bench_parse page1.html page2.html --iterations 20
+    python -m benchmarks.bench_parse --corpus benchmarks/corpus
+"""
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+from benchmarks.corpus import CORPUS_DIR, iter_pages
+from src.util import read_files
+from src.zillow_scraper import ZillowHtmlDownloader, ZillowResultsPage
+from src.zillow_scraper import parse_properties
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pages', nargs='*', help='saved search result pages')
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='corpus dir')
+    parser.add_argument(
+        '--iterations',
+        type=int,
+        default=10,
+        help='number of passes over the pages')
+    return parser.parse_args()
+
+
+def parse_saved_page(text):
+    """ Pagination lookup plus property extraction, like a first page """
+    page = ZillowResultsPage(text)
+    downloader = ZillowHtmlDownloader(None, '00000')
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            downloader.parse_zillow_response(page)
+        except (IndexError, ValueError):
+            # page without pagination or result count
+            pass
+    return parse_properties(page)
+
+
+def corpus_texts(corpus_dir):
+    return read_files([path for _, _, path in iter_pages(corpus_dir)])
+
+
+def peak_memory(texts):
+    """ Peak bytes python allocated while parsing each page once, the trees
+    lxml builds in C are not traced """
+    tracemalloc.start()
+    for text in texts:
+        parse_saved_page(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(texts, iterations):
+    listings = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            listings += len(parse_saved_page(text))
+    elapsed = time.perf_counter() - start
+    pages = iterations * len(texts)
+    return {
+        'pages': pages,
+        'listings': listings,
+        'seconds': elapsed,
+        'ms_per_page': elapsed / pages * 1000.0,
+        'pages_per_second': pages / elapsed,
+        'listings_per_second': listings / elapsed,
+    }
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    texts = read_files(args.pages) if args.pages else corpus_texts(args.corpus)
+    result = run(texts, args.iterations)
+    print('{pages} pages, {listings} listings in {seconds:.2f}s: '
+          '{ms_per_page:.1f} ms/page, {listings_per_second:.0f} listings/s'.format(
+              **result))
+    print('peak python memory {:.1f} MB'.format(peak_memory(texts) / 1e6))
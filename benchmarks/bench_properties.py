@@ -0,0 +1,83 @@
+""" Measure memory used by parsed listings
+
+    python -m benchmarks.bench_properties --listings 10000
+"""
+import argparse
+import time
+import tracemalloc
+
+from src.properties import ZillowPropertyJson
+
+try:
+    from src.properties import PropertyBatch
+except ImportError:
+    PropertyBatch = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--listings',
+        type=int,
+        default=10000,
+        help='number of listings to build')
+    return parser.parse_args()
+
+
+def make_listing(i):
+    """ Search result json shaped like a mobileSearchPageStore listResult """
+    zpid = 10000000 + i
+    return {
+        'zpid': str(zpid),
+        'address': '{} Main St, Springfield, IL 62704'.format(i),
+        'price': '${:,}'.format(150000 + i * 7),
+        'beds': 3,
+        'baths': 2.5,
+        'area': 1400 + i % 900,
+        'brokerName': 'Broker {}'.format(i % 50),
+        'detailUrl': 'https://www.zillow.com/homedetails/{}_zpid/'.format(zpid),
+        'statusText': 'House for sale',
+        'hdpData': {'homeInfo': {
+            'city': 'Springfield',
+            'state': 'IL',
+            'zipcode': '62704',
+            'daysOnZillow': i % 90}},
+    }
+
+
+def measure(build):
+    """ Memory still held by the result of build once its inputs are gone """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def build_properties(count):
+    listings = [make_listing(i) for i in range(count)]
+    start = time.perf_counter()
+    properties = [ZillowPropertyJson(listing) for listing in listings]
+    print('built {} properties in {:.3f}s'.format(
+        count, time.perf_counter() - start))
+    return properties
+
+
+def run(count):
+    results = {}
+    properties, size, elapsed = measure(lambda: build_properties(count))
+    results['properties'] = (size, elapsed)
+    if PropertyBatch is not None:
+        _, size, elapsed = measure(
+            lambda: PropertyBatch.from_properties(properties))
+        results['batch'] = (size, elapsed)
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for name, (size, elapsed) in run(args.listings).items():
+        print('{}: {:.2f} MB ({:.0f} bytes/listing) held, built in {:.3f}s'.format(
+            name, size / 1e6, size / args.listings, elapsed))
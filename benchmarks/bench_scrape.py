@@ -0,0 +1,81 @@
+""" End to end scrape of the benchmark corpus through the replay fetcher
+
+Fetching, parsing, de-duplication and the csv sink run like a real scrape,
+only the pages come from disk after the simulated latency.
+
+    python -m benchmarks.bench_scrape --latency 0.2 --concurrency 4
+"""
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
+import time
+
+from benchmarks.corpus import CORPUS_DIR, load_manifest
+from benchmarks.replay import ReplayFetcher
+from src.zillow_scraper import ZillowScraperCsv
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='corpus dir')
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.05,
+        help='seconds every simulated request takes')
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.0,
+        help='max random seconds added to the latency')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=4,
+        help='number of result pages to fetch at the same time')
+    return parser.parse_args()
+
+
+class ReplayScraper(ZillowScraperCsv):
+    """ ZillowScraperCsv reading pages from a ReplayFetcher """
+
+    def __init__(self, fetcher, zip_codes, outdir, **kwargs):
+        super(ReplayScraper, self).__init__(zip_codes, outdir, **kwargs)
+        self.fetcher = fetcher
+
+    def create_client(self):
+        return self.fetcher
+
+
+def run(corpus_dir, latency=0.05, jitter=0.0, concurrency=4):
+    zip_codes = sorted(load_manifest(corpus_dir))
+    fetcher = ReplayFetcher(corpus_dir, latency=latency, jitter=jitter)
+    outdir = tempfile.mkdtemp()
+    try:
+        zsearch = ReplayScraper(fetcher, zip_codes, outdir,
+                                concurrency=concurrency,
+                                rate=1000.0,
+                                jitter=0.0)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            zsearch.scrape()
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(outdir)
+    return {
+        'zip_codes': len(zip_codes),
+        'pages': fetcher.requests,
+        'listings': zsearch.rows_written,
+        'seconds': elapsed,
+        'pages_per_second': fetcher.requests / elapsed,
+    }
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    result = run(args.corpus, args.latency, args.jitter, args.concurrency)
+    print('{zip_codes} zip codes, {pages} pages, {listings} listings in '
+          '{seconds:.2f}s ({pages_per_second:.1f} pages/s)'.format(**result))
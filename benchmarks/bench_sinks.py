@@ -0,0 +1,63 @@
+""" Time writing listings with every local output format
+
+    python -m benchmarks.bench_sinks --rows 100000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.bench_properties import make_listing
+from src.properties import ZillowPropertyJson
+from src.sinks import WRITERS, import_pyarrow, open_writer
+from src.zillow_scraper import ZillowScraper
+
+# rows handed to the writer per call, about one results page
+PAGE_SIZE = 40
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=100000,
+        help='number of listings to write')
+    return parser.parse_args()
+
+
+def write_all(output_format, path, fieldnames, properties):
+    start = time.perf_counter()
+    writer = open_writer(output_format, path, fieldnames)
+    for i in range(0, len(properties), PAGE_SIZE):
+        writer.write(properties[i:i + PAGE_SIZE])
+    writer.close()
+    return time.perf_counter() - start
+
+
+def run(count):
+    properties = [ZillowPropertyJson(make_listing(i)) for i in range(count)]
+    fieldnames = ZillowScraper([]).fieldnames
+    outdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for output_format, writer_class in sorted(WRITERS.items()):
+            if output_format == 'parquet' and import_pyarrow() is None:
+                continue
+            path = os.path.join(outdir, 'bench.' + writer_class.EXTENSION)
+            elapsed = write_all(output_format, path, fieldnames, properties)
+            results[output_format] = (elapsed, os.path.getsize(path))
+    finally:
+        shutil.rmtree(outdir)
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run(args.rows)
+    baseline = results['csv'][0]
+    for output_format, (elapsed, size) in sorted(results.items()):
+        print('{:8s} {:.2f}s ({:.0f} rows/s, {:.2f}x csv) {:.1f} MB'.format(
+            output_format, elapsed, args.rows / elapsed, baseline / elapsed,
+            size / 1e6))
@@ -0,0 +1,89 @@
+""" Measure how long the entry points take to import
+
+Every entry point is imported in a fresh interpreter, the best of repeat
+runs is kept and the startup of a bare interpreter is subtracted. With
+--modules the slowest imports of each entry point are listed.
+
+    python -m benchmarks.bench_startup --repeat 5 --modules 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# what each entry point imports before doing any work
+ENTRY_POINTS = {
+    'cli': "import runpy; runpy.run_path('__main__.py', run_name='cli')",
+    'web': 'import app',
+    'jobs': 'import src.jobs',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='imports per entry point, the fastest one counts')
+    parser.add_argument(
+        '--modules',
+        type=int,
+        default=0,
+        help='number of slowest imported modules to list')
+    return parser.parse_args()
+
+
+def run_python(code, *options):
+    """ Returns (seconds, stderr) of code run in a new interpreter """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable] + list(options) + ['-c', code],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception(process.stderr.decode('utf8').strip().splitlines()[-1])
+    return elapsed, process.stderr.decode('utf8')
+
+
+def best_time(code, repeat):
+    return min(run_python(code)[0] for _ in range(repeat))
+
+
+def slowest_modules(code, count):
+    """ (cumulative ms, module) of the slowest top level imports """
+    _, importtime = run_python(code, '-X', 'importtime')
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative) / 1000.0, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def run(repeat=5):
+    """ Entry point -> ms to import it, entry points that fail to import
+    (e.g. a missing dependency) are left out """
+    interpreter = best_time('pass', repeat)
+    results = {}
+    for name, code in sorted(ENTRY_POINTS.items()):
+        try:
+            results[name] = (best_time(code, repeat) - interpreter) * 1000
+        except Exception as e:
+            print('Skipping {}: {}'.format(name, e))
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for name, ms in sorted(run(args.repeat).items()):
+        print('{:10s} {:8.1f} ms'.format(name, ms))
+        if args.modules:
+            for cumulative, module in slowest_modules(
+                    ENTRY_POINTS[name], args.modules):
+                print('    {:8.1f} ms  {}'.format(cumulative, module))
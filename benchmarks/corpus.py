@@ -0,0 +1,169 @@
+""" Search result pages the benchmarks run on
+
+The corpus is a directory of pages named <zip code>_<page>.html plus a
+manifest.json with the layout and result count of every zip code. Pages can
+be recorded from zillow with get_response, or generated in both layouts:
+the mobileSearchPageStore json of current pages and the older list cards.
+
+    python -m benchmarks.corpus generate --outdir benchmarks/corpus
+    python -m benchmarks.corpus record 60614 --outdir benchmarks/corpus
+"""
+import argparse
+import json
+import os
+
+from benchmarks.bench_properties import make_listing
+from src.util import get_headers, get_response, get_tor_client
+from src.zillow_scraper import ZillowHtmlDownloader, ZillowResultsPage
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+MANIFEST = 'manifest.json'
+JSON_LAYOUT = 'json'
+CARDS_LAYOUT = 'cards'
+PROPERTIES_PER_PAGE = 40
+# real result pages carry a few hundred kB of unrelated markup
+FILLER_BLOCKS = 4000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=('generate', 'record'))
+    parser.add_argument('zip_codes', nargs='*', help='zip codes to record')
+    parser.add_argument('--outdir', default=CORPUS_DIR, help='corpus dir')
+    parser.add_argument(
+        '--results',
+        type=int,
+        default=400,
+        help='listings per generated zip code')
+    return parser.parse_args()
+
+
+def page_path(corpus_dir, zip_code, page):
+    return os.path.join(corpus_dir, '{}_{}.html'.format(zip_code, page))
+
+
+def load_manifest(corpus_dir):
+    path = os.path.join(corpus_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def save_manifest(corpus_dir, manifest):
+    with open(os.path.join(corpus_dir, MANIFEST), 'w') as outfile:
+        json.dump(manifest, outfile, indent=2, sort_keys=True)
+
+
+def iter_pages(corpus_dir):
+    """ Yield (zip code, page, path) of every page in the corpus """
+    for zip_code, entry in sorted(load_manifest(corpus_dir).items()):
+        for page in range(1, entry['pages'] + 1):
+            yield zip_code, page, page_path(corpus_dir, zip_code, page)
+
+
+def filler():
+    return ''.join(
+        '<div class="c{0}"><span>filler {0}</span><a href="/x/{0}">l</a></div>'.format(i)
+        for i in range(FILLER_BLOCKS))
+
+
+def page_shell(zip_code, total, body):
+    return ('<html><head></head><body>{}'
+            '<div class="total-text">{}</div>'
+            '<nav role="navigation" aria-label="Pagination"><ul><li>'
+            '<a href="/homes/for_sale/{}_rb/">2</a></li></ul></nav>'
+            '{}</body></html>').format(filler(), total, zip_code, body)
+
+
+def json_page(zip_code, listings, total):
+    store = {'cat1': {'searchResults': {'listResults': listings}}}
+    return page_shell(zip_code, total, (
+        '<script type="application/json" '
+        'data-zrr-shared-data-key="mobileSearchPageStore"><!--{}--></script>'
+        ).format(json.dumps(store, indent=1)))
+
+
+def cards_page(zip_code, listings, total):
+    scripts = []
+    cards = []
+    for listing in listings:
+        home = listing['hdpData']['homeInfo']
+        scripts.append('<li><script type="application/ld+json">{}</script></li>'.format(
+            json.dumps({
+                '@type': 'SingleFamilyResidence',
+                'address': {'addressLocality': home['city'],
+                            'addressRegion': home['state'],
+                            'postalCode': zip_code},
+                'numberOfRooms': listing['beds'],
+                'url': listing['detailUrl'].replace('https://www.zillow.com', '')})))
+        cards.append(
+            '<article class="list-card list-card-short list-card_not-saved">'
+            '<div class="list-card-top"><div class="list-card-variable-text '
+            'list-card-img-overlay">{} days on Zillow</div></div>'
+            '<h3 class="list-card-addr">{}</h3>'
+            '<div class="list-card-price">{}</div>'
+            '<span class="zsg-icon-for-sale"></span>'
+            '<div class="list-card-truncate">{}</div></article>'.format(
+                home['daysOnZillow'], listing['address'], listing['price'],
+                listing['brokerName']))
+    return page_shell(zip_code, total, '<ul>{}</ul>{}'.format(
+        ''.join(scripts), ''.join(cards)))
+
+
+def generate(corpus_dir, results):
+    """ One zip code per layout with results listings each """
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest = load_manifest(corpus_dir)
+    for zip_code, layout, render in (('10001', JSON_LAYOUT, json_page),
+                                     ('10002', CARDS_LAYOUT, cards_page)):
+        offset = int(zip_code) * 1000
+        pages = max(1, -(-results // PROPERTIES_PER_PAGE))
+        for page in range(1, pages + 1):
+            start = (page - 1) * PROPERTIES_PER_PAGE
+            listings = [make_listing(offset + i) for i in
+                        range(start, min(results, start + PROPERTIES_PER_PAGE))]
+            with open(page_path(corpus_dir, zip_code, page), 'w') as outfile:
+                outfile.write(render(zip_code, listings, results))
+        manifest[zip_code] = {'layout': layout, 'pages': pages,
+                              'results': results, 'source': 'generated'}
+    save_manifest(corpus_dir, manifest)
+    return manifest
+
+
+def record(corpus_dir, zip_codes):
+    """ Save every result page of zip_codes as zillow serves them now """
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest = load_manifest(corpus_dir)
+    tr = get_tor_client()
+    for zip_code in zip_codes:
+        downloader = ZillowHtmlDownloader(tr, zip_code)
+        response = get_response(tr, downloader.create_starting_url(),
+                                get_headers(),
+                                response_path=page_path(corpus_dir, zip_code, 1))
+        if response is None:
+            print('Failed to record {}'.format(zip_code))
+            continue
+        first_page = ZillowResultsPage(response.text)
+        page_urls = downloader.parse_zillow_response(first_page)
+        for page, url in page_urls:
+            get_response(tr, url, get_headers(),
+                         response_path=page_path(corpus_dir, zip_code, page))
+        if 'mobileSearchPageStore' in response.text:
+            layout = JSON_LAYOUT
+        else:
+            layout = CARDS_LAYOUT
+        manifest[zip_code] = {'layout': layout, 'pages': len(page_urls) + 1,
+                              'results': None, 'source': 'recorded'}
+    save_manifest(corpus_dir, manifest)
+    return manifest
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'generate':
+        manifest = generate(args.outdir, args.results)
+    else:
+        manifest = record(args.outdir, args.zip_codes)
+    for zip_code, entry in sorted(manifest.items()):
+        print('{}: {pages} {layout} pages ({source})'.format(zip_code, **entry))
@@ -0,0 +1,57 @@
+""" Fetcher serving corpus pages from disk instead of zillow """
+import random
+import re
+import threading
+import time
+
+from benchmarks.corpus import page_path
+from src.cache import CachedResponse
+
+ZIP_CODE_REGEX = re.compile(r'/(\d{5})_rb')
+PAGE_REGEX = re.compile(r'/(\d+)_p')
+
+
+class ReplayResponse(CachedResponse):
+    def __init__(self, url, text, status_code=200):
+        super(ReplayResponse, self).__init__(url, text)
+        self.status_code = status_code
+        self.from_cache = False
+
+
+class ReplayFetcher(object):
+    """ Drop in for HttpFetcher: answers search urls with the matching corpus
+    page after latency seconds plus up to jitter seconds, 404 if missing """
+
+    def __init__(self, corpus_dir, latency=0.0, jitter=0.0):
+        self.corpus_dir = corpus_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.pages = {}
+
+    def read_page(self, zip_code, page):
+        key = (zip_code, page)
+        if key not in self.pages:
+            try:
+                with open(page_path(self.corpus_dir, zip_code, page)) as infile:
+                    self.pages[key] = infile.read()
+            except IOError:
+                self.pages[key] = None
+        return self.pages[key]
+
+    def get(self, url, headers=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+        delay = self.latency + random.random() * self.jitter
+        if delay > 0:
+            time.sleep(delay)
+        zip_code = ZIP_CODE_REGEX.search(url).group(1)
+        match = PAGE_REGEX.search(url)
+        text = self.read_page(zip_code, int(match.group(1)) if match else 1)
+        if text is None:
+            return ReplayResponse(url, '', status_code=404)
+        return ReplayResponse(url, text)
+
+    def reset_identity(self):
+        return False
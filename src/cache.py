@@ -0,0 +1,177 @@
+""" On disk cache of zillow search pages in front of get_response """
+import sqlite3
+import threading
+import time
+import zlib
+
+from decouple import config
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from src.util import CAPTCHA_TEXT
+
+RESPONSE_CACHE_PATH = config(
+    'RESPONSE_CACHE_PATH', default='/tmp/.zillow_cache.sqlite')
+# seconds a cached page is served without asking zillow, 0 disables the cache
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=900, cast=int)
+RESPONSE_CACHE_MAX_MB = config('RESPONSE_CACHE_MAX_MB', default=200, cast=int)
+
+
+def normalize_url(url):
+    """ Cache key of a search url: lower case host, sorted query, no fragment """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path,
+                       query, ''))
+
+
+class CachedResponse(object):
+    """ Minimal stand in for requests.Response served from the cache """
+
+    def __init__(self, url, text, headers=None):
+        self.url = url
+        self.text = text
+        self.status_code = 200
+        self.headers = headers or {}
+        self.from_cache = True
+
+
+class ResponseCache(object):
+    """ Compressed pages in sqlite with a ttl, a size cap and lru eviction """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL,
+                 max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'key TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, '
+            'stored_at REAL, accessed_at REAL, size INTEGER)')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)')
+        self.db.commit()
+
+    def get(self, url):
+        """ Returns (text, etag, last_modified, is_fresh) or None """
+        key = normalize_url(url)
+        with self.lock:
+            row = self.db.execute(
+                'SELECT body, etag, last_modified, stored_at FROM pages '
+                'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE pages SET accessed_at = ? WHERE key = ?',
+                            (time.time(), key))
+            self.db.commit()
+        body, etag, last_modified, stored_at = row
+        text = zlib.decompress(body).decode('utf8')
+        return text, etag, last_modified, time.time() - stored_at < self.ttl
+
+    def put(self, url, text, etag=None, last_modified=None):
+        body = zlib.compress(text.encode('utf8'))
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (normalize_url(url), body, etag, last_modified, now, now,
+                 len(body)))
+            self.evict()
+            self.db.commit()
+
+    def touch(self, url):
+        """ Mark a revalidated page as fresh again """
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'UPDATE pages SET stored_at = ?, accessed_at = ? WHERE key = ?',
+                (now, now, normalize_url(url)))
+            self.db.commit()
+
+    def evict(self):
+        """ Drop least recently used pages until under max_bytes """
+        total = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute(
+            'SELECT key, size FROM pages ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.db.execute('DELETE FROM pages WHERE key = ?', (key,))
+            total -= size
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class CachedFetcher(object):
+    """ Wraps a fetcher, serving fresh pages from a ResponseCache and
+    revalidating stale ones with If-None-Match / If-Modified-Since """
+
+    def __init__(self, fetcher, cache):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # reset_identity, connection_stats, ... of the wrapped fetcher
+        return getattr(self.fetcher, name)
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def peek(self, url):
+        """ The fresh cached response of url without any request, or None
+        when url has to go to the network """
+        cached = self.cache.get(url)
+        if cached is None or not cached[3]:
+            return None
+        self.count('hits')
+        return CachedResponse(url, cached[0])
+
+    def get(self, url, headers=None, **kwargs):
+        cached = self.cache.get(url)
+        if cached is not None:
+            text, etag, last_modified, is_fresh = cached
+            if is_fresh:
+                self.count('hits')
+                return CachedResponse(url, text)
+            headers = dict(headers or {})
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.fetcher.get(url, headers=headers, **kwargs)
+        if cached is not None and response.status_code == 304:
+            self.cache.touch(url)
+            self.count('revalidated')
+            return CachedResponse(url, cached[0], response.headers)
+
+        self.count('misses')
+        if response.status_code == 200 and CAPTCHA_TEXT not in response.text:
+            self.cache.put(url,
+                           response.text,
+                           etag=response.headers.get('ETag'),
+                           last_modified=response.headers.get('Last-Modified'))
+        return response
+
+    def cache_stats(self):
+        requests_seen = self.hits + self.revalidated + self.misses
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.revalidated) / requests_seen
+            if requests_seen else 0.0,
+        }
@@ -0,0 +1,190 @@
+""" Checkpoints of scraped pages so an interrupted scrape can be resumed
+
+Every parsed page is saved with its listings before they go to the sink,
+together with the (page, url) pairs of the zip code once the first page is
+read. A zip code is marked finished with the listings that went to the
+output. A resumed scrape replays finished zip codes and pages from the
+checkpoint and only fetches what is missing.
+
+Command line runs keep checkpoints in a sqlite file, rq jobs in redis.
+"""
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from decouple import config
+
+from src.properties import Property
+
+CHECKPOINT_PATH = config(
+    'CHECKPOINT_PATH',
+    default=os.path.expanduser('~/.zillow_checkpoints.sqlite'))
+# older checkpoints are too stale to resume from
+CHECKPOINT_TTL = config('CHECKPOINT_TTL', default=86400, cast=int)
+
+
+def encode_properties(properties):
+    data = json.dumps([prop.to_dict() for prop in properties])
+    return zlib.compress(data.encode('utf8'))
+
+
+def decode_properties(data):
+    return [Property.from_dict(row)
+            for row in json.loads(zlib.decompress(data).decode('utf8'))]
+
+
+class Checkpoint(object):
+    """ What was saved of a zip code
+
+    pages: page number -> parsed properties of the page
+    page_urls: (page, url) pairs of the other pages, None until the first
+        page was saved
+    output: properties handed to the sink, None until the zip code finished
+    """
+
+    def __init__(self, pages=None, page_urls=None, output=None):
+        self.pages = pages or {}
+        self.page_urls = page_urls
+        self.output = output
+
+    @property
+    def is_finished(self):
+        return self.output is not None
+
+    def remaining(self, page_urls=None):
+        """ The (page, url) pairs that are not checkpointed yet """
+        if page_urls is None:
+            page_urls = self.page_urls or []
+        return [(page, url) for page, url in page_urls
+                if page not in self.pages]
+
+
+def load_page_urls(data):
+    return [tuple(page_url) for page_url in json.loads(data)]
+
+
+class CheckpointStore(object):
+    """ Checkpoints in a sqlite file for command line runs
+
+    scope keeps runs whose output differs apart, e.g. --since-last runs
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH, ttl=CHECKPOINT_TTL, scope=''):
+        self.ttl = ttl
+        self.scope = scope
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'scope TEXT, zip_code TEXT, page INTEGER, properties BLOB, '
+            'saved_at REAL, PRIMARY KEY (scope, zip_code, page))')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS zip_codes ('
+            'scope TEXT, zip_code TEXT, page_urls TEXT, output BLOB, '
+            'saved_at REAL, PRIMARY KEY (scope, zip_code))')
+        self.prune()
+
+    def prune(self):
+        expired = time.time() - self.ttl
+        self.db.execute('DELETE FROM pages WHERE saved_at < ?', (expired,))
+        self.db.execute('DELETE FROM zip_codes WHERE saved_at < ?', (expired,))
+        self.db.commit()
+
+    def load(self, zip_code):
+        expired = time.time() - self.ttl
+        row = self.db.execute(
+            'SELECT page_urls, output FROM zip_codes WHERE scope = ? AND '
+            'zip_code = ? AND saved_at >= ?',
+            (self.scope, zip_code, expired)).fetchone()
+        if row is None:
+            # pages without the page urls can't be resumed
+            return Checkpoint()
+        page_urls, output = row
+        if output is not None:
+            return Checkpoint(output=decode_properties(output))
+        rows = self.db.execute(
+            'SELECT page, properties FROM pages WHERE scope = ? AND '
+            'zip_code = ? AND saved_at >= ?',
+            (self.scope, zip_code, expired)).fetchall()
+        return Checkpoint(
+            pages={page: decode_properties(data) for page, data in rows},
+            page_urls=load_page_urls(page_urls))
+
+    def save_page(self, zip_code, page, properties, page_urls=None):
+        """ page_urls are saved along with the first page """
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+            (self.scope, zip_code, page, encode_properties(properties), now))
+        if page_urls is not None:
+            self.db.execute(
+                'INSERT OR REPLACE INTO zip_codes VALUES (?, ?, ?, NULL, ?)',
+                (self.scope, zip_code, json.dumps(page_urls), now))
+        self.db.commit()
+
+    def finish(self, zip_code, output):
+        """ zip_code is done, its pages are replaced by the output """
+        self.db.execute(
+            'DELETE FROM pages WHERE scope = ? AND zip_code = ?',
+            (self.scope, zip_code))
+        self.db.execute(
+            'INSERT OR REPLACE INTO zip_codes VALUES (?, ?, NULL, ?, ?)',
+            (self.scope, zip_code, encode_properties(output), time.time()))
+        self.db.commit()
+
+    def clear(self, zip_code):
+        self.db.execute(
+            'DELETE FROM pages WHERE scope = ? AND zip_code = ?',
+            (self.scope, zip_code))
+        self.db.execute(
+            'DELETE FROM zip_codes WHERE scope = ? AND zip_code = ?',
+            (self.scope, zip_code))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class RedisCheckpointStore(object):
+    """ Checkpoints in redis for rq jobs, they expire ttl seconds after the
+    last save """
+    CHECKPOINT_KEY = 'zillow:checkpoint:{}'
+    PAGE_FIELD = 'page:{}'
+
+    def __init__(self, connection, ttl=CHECKPOINT_TTL):
+        self.connection = connection
+        self.ttl = ttl
+
+    def load(self, zip_code):
+        fields = self.connection.hgetall(self.CHECKPOINT_KEY.format(zip_code))
+        fields = {name.decode('utf8'): data for name, data in fields.items()}
+        if 'output' in fields:
+            return Checkpoint(output=decode_properties(fields['output']))
+        pages = {int(name.split(':')[1]): decode_properties(data)
+                 for name, data in fields.items() if name.startswith('page:')}
+        page_urls = fields.get('page_urls')
+        return Checkpoint(
+            pages=pages,
+            page_urls=load_page_urls(page_urls) if page_urls else None)
+
+    def save_page(self, zip_code, page, properties, page_urls=None):
+        key = self.CHECKPOINT_KEY.format(zip_code)
+        fields = {self.PAGE_FIELD.format(page): encode_properties(properties)}
+        if page_urls is not None:
+            fields['page_urls'] = json.dumps(page_urls)
+        pipe = self.connection.pipeline()
+        pipe.hmset(key, fields)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def finish(self, zip_code, output):
+        key = self.CHECKPOINT_KEY.format(zip_code)
+        pipe = self.connection.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, 'output', encode_properties(output))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def clear(self, zip_code):
+        self.connection.delete(self.CHECKPOINT_KEY.format(zip_code))
@@ -0,0 +1,220 @@
+""" Pool of fetch clients, one per tor circuit or proxy
+
+A page is fetched through a circuit picked by health (success rate and
+latency) or round robin. A circuit that gets a captcha page is quarantined
+for a while, asked for a new tor identity and the page is retried on
+another circuit. Any object with a requests style get() can be a client, so
+local stand-in proxies or fake clients work for testing.
+
+    ZILLOW_TOR_CIRCUITS=9050:9051,9060:9061   socks port:control port pairs
+    ZILLOW_PROXIES=socks5h://10.0.0.2:1080,http://10.0.0.3:3128
+    ZILLOW_DIRECT_CLIENTS=2                   plain sessions without a proxy
+"""
+import itertools
+import random
+import requests
+import threading
+import time
+
+from decouple import Csv, config
+
+from src.fetcher import HttpFetcher
+from src.util import CAPTCHA_TEXT, get_headers
+
+ZILLOW_TOR_CIRCUITS = config('ZILLOW_TOR_CIRCUITS', default='', cast=Csv())
+ZILLOW_PROXIES = config('ZILLOW_PROXIES', default='', cast=Csv())
+ZILLOW_DIRECT_CLIENTS = config('ZILLOW_DIRECT_CLIENTS', default=0, cast=int)
+# health favours good success rates and latency, round-robin takes turns
+CLIENT_POOL_STRATEGY = config('CLIENT_POOL_STRATEGY', default='health')
+CAPTCHA_QUARANTINE = config('CAPTCHA_QUARANTINE', default=300, cast=int)
+STRATEGIES = ('health', 'round-robin')
+
+
+class Circuit(object):
+    """ A client of the pool with its success rate and latency """
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.captchas = 0
+        self.latency = 0.0
+        self.quarantined_until = 0.0
+
+    def is_available(self, now):
+        return now >= self.quarantined_until
+
+    @property
+    def success_rate(self):
+        # untried circuits start out as good as any
+        return (self.successes + 1.0) / (self.requests + 1.0)
+
+    @property
+    def average_latency(self):
+        return self.latency / self.requests if self.requests else 0.0
+
+    @property
+    def health(self):
+        return self.success_rate / (1.0 + self.average_latency)
+
+    def record(self, latency, success):
+        self.requests += 1
+        self.latency += latency
+        if success:
+            self.successes += 1
+        else:
+            self.failures += 1
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'captchas': self.captchas,
+            'success_rate': round(self.success_rate, 3),
+            'average_latency': round(self.average_latency, 3),
+            'quarantined': self.quarantined_until > time.time(),
+        }
+
+
+class ClientPool(object):
+    """ Fetcher handing every request to one of several circuits """
+
+    def __init__(self, clients, strategy=CLIENT_POOL_STRATEGY,
+                 quarantine=CAPTCHA_QUARANTINE):
+        assert clients, 'a client pool needs at least one client'
+        assert strategy in STRATEGIES, 'unknown strategy {}'.format(strategy)
+        self.circuits = [Circuit(name, client) for name, client in clients]
+        self.strategy = strategy
+        self.quarantine = quarantine
+        self.turns = itertools.count()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def pick(self, exclude=()):
+        """ Next circuit to use, None if all are quarantined or excluded """
+        now = time.time()
+        with self.lock:
+            available = [circuit for circuit in self.circuits
+                         if circuit.is_available(now) and circuit not in exclude]
+            if not available:
+                return None
+            if self.strategy == 'round-robin':
+                return available[next(self.turns) % len(available)]
+            # weighted so healthy circuits get most pages, but not all of them
+            return random.choices(
+                available, weights=[circuit.health for circuit in available])[0]
+
+    def record(self, circuit, latency, success):
+        with self.lock:
+            circuit.record(latency, success)
+
+    def quarantine_circuit(self, circuit):
+        print('Captcha on {}, quarantined for {}s'.format(
+            circuit.name, self.quarantine))
+        with self.lock:
+            circuit.captchas += 1
+            circuit.quarantined_until = time.time() + self.quarantine
+        if hasattr(circuit.client, 'reset_identity'):
+            circuit.client.reset_identity()
+
+    def get(self, url, headers=None, **kwargs):
+        """ Fetch url, moving on to another circuit after a captcha or a
+        connection error. The last response or error is passed on when
+        every circuit failed. """
+        tried = []
+        response = None
+        while True:
+            circuit = self.pick(exclude=tried)
+            if circuit is None:
+                if response is None:
+                    raise requests.ConnectionError(
+                        'No circuit available for {}'.format(url))
+                return response
+            tried.append(circuit)
+            self.local.circuit = circuit
+            start = time.monotonic()
+            try:
+                response = circuit.client.get(url, headers=headers, **kwargs)
+            except requests.RequestException:
+                self.record(circuit, time.monotonic() - start, False)
+                if len(tried) == len(self.circuits):
+                    raise
+                continue
+            latency = time.monotonic() - start
+            if CAPTCHA_TEXT in response.text:
+                self.record(circuit, latency, False)
+                self.quarantine_circuit(circuit)
+                continue
+            self.record(circuit, latency, response.status_code == 200)
+            return response
+
+    def reset_identity(self):
+        """ New tor identity for the circuit last used by this thread """
+        circuit = getattr(self.local, 'circuit', None)
+        if circuit is None or not hasattr(circuit.client, 'reset_identity'):
+            return False
+        return circuit.client.reset_identity()
+
+    def circuit_stats(self):
+        with self.lock:
+            return {circuit.name: circuit.stats() for circuit in self.circuits}
+
+    def connection_stats(self):
+        stats = {'total': {'requests': 0, 'connections': 0, 'reused': 0}}
+        for circuit in self.circuits:
+            if not hasattr(circuit.client, 'connection_stats'):
+                continue
+            total = circuit.client.connection_stats()['total']
+            stats[circuit.name] = total
+            for field in stats['total']:
+                stats['total'][field] += total[field]
+        return stats
+
+    def close(self):
+        for circuit in self.circuits:
+            if hasattr(circuit.client, 'close'):
+                circuit.client.close()
+
+
+def proxy_client(proxy):
+    return HttpFetcher(proxies={'http': proxy, 'https': proxy},
+                       headers=get_headers())
+
+
+def tor_client(proxy_port, ctrl_port, password):
+    from torrequest import TorRequest
+
+    tr = TorRequest(proxy_port=proxy_port, ctrl_port=ctrl_port,
+                    password=password)
+    tr.reset_identity()
+    return HttpFetcher(proxies=tr.session.proxies, headers=get_headers(),
+                       tor=tr)
+
+
+def create_client_pool(tor_circuits=ZILLOW_TOR_CIRCUITS,
+                       proxies=ZILLOW_PROXIES,
+                       direct_clients=ZILLOW_DIRECT_CLIENTS,
+                       strategy=CLIENT_POOL_STRATEGY):
+    """ ClientPool of the configured circuits, None if none are configured """
+    clients = []
+    password = config('TOR_PASSWORD', '')
+    for circuit in tor_circuits:
+        proxy_port, ctrl_port = circuit.split(':')
+        try:
+            clients.append(('tor:{}'.format(proxy_port),
+                            tor_client(int(proxy_port), int(ctrl_port),
+                                       password)))
+        except OSError as e:
+            print('Tor circuit {} not available: {}'.format(circuit, e))
+    for proxy in proxies:
+        clients.append((proxy, proxy_client(proxy)))
+    for index in range(direct_clients):
+        clients.append(('direct:{}'.format(index),
+                        HttpFetcher(headers=get_headers())))
+    if not clients:
+        return None
+    print('Fetching through {} circuits'.format(len(clients)))
+    return ClientPool(clients, strategy=strategy)
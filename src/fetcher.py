@@ -0,0 +1,104 @@
+""" Pooled http fetching shared by the downloader and the rq worker """
+import threading
+
+from decouple import config
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+HTTP_POOL_SIZE = config('HTTP_POOL_SIZE', default=10, cast=int)
+HTTP_TIMEOUT = config('HTTP_TIMEOUT', default=30.0, cast=float)
+
+
+def pool_managers(session):
+    """ urllib3 pool managers of a session, requests through a proxy (tor
+    included) go through a proxy manager instead of the pool manager """
+    for adapter in set(session.adapters.values()):
+        yield adapter.poolmanager
+        for manager in list(adapter.proxy_manager.values()):
+            yield manager
+
+
+class HttpFetcher(object):
+    """ Keeps one keep-alive requests.Session per host
+
+    pool_size: max connections kept open per host
+    timeout: default per request timeout in seconds
+    proxies: requests style proxies, e.g. the socks proxy of a tor client
+    tor: optional TorRequest used to reset the tor identity
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT,
+                 proxies=None, headers=None, tor=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.proxies = proxies or {}
+        self.headers = headers or {}
+        self.tor = tor
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create_session(self):
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(self.headers)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        session.headers['Connection'] = 'keep-alive'
+        session.proxies.update(self.proxies)
+        return session
+
+    def session_for(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.create_session()
+                self.sessions[host] = session
+        return session
+
+    def get(self, url, headers=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session_for(url).get(url, headers=headers, **kwargs)
+
+    def reset_identity(self):
+        """ Ask tor for a new circuit, drops pooled connections to do so """
+        if self.tor is None:
+            return False
+        self.tor.reset_identity()
+        self.close()
+        return True
+
+    def connection_stats(self):
+        """ Requests sent and new connections opened, per host and in total """
+        stats = {}
+        with self.lock:
+            sessions = list(self.sessions.items())
+        for host, session in sessions:
+            requests_sent = 0
+            connections = 0
+            for manager in pool_managers(session):
+                pools = manager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+            stats[host] = {
+                'requests': requests_sent,
+                'connections': connections,
+                'reused': max(0, requests_sent - connections),
+            }
+        stats['total'] = {
+            field: sum(host_stats[field] for host_stats in stats.values())
+            for field in ('requests', 'connections', 'reused')}
+        return stats
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            session.close()
@@ -0,0 +1,170 @@
+""" Google Sheets export of scraped zip codes
+
+gspread and oauth2client are only imported once a sheets client is created
+and GOOGLE_CREDENTIALS is parsed at the same time, so local runs and the web
+app start without them.
+"""
+import datetime
+import json
+import re
+
+from decouple import config
+
+from src.metrics import timed
+from src.profiling import RunProfile, save_to_current_job
+from src.properties import PropertyBatch
+from src.sheets_batch import SheetsBatch
+from src.util import EMAIL_REGEX
+from src.zillow_scraper import ZillowScraper
+
+# parsed by google_credentials()
+CREDENTIALS = None
+
+
+INFO = """\
+Here are your Zillow results for {}
+
+Results are provided by Engineered Cash Flow LLC
+Please support us by following us:
+https://www.facebook.com/engineeredcashflow
+https://www.instagram.com/engineeredcashflow
+https://www.engineeredcashflow.com
+
+Disclaimer:
+
+All investments, including real estate, are highly speculative in nature and
+involve substantial risk of loss. We encourage our investors to invest very
+carefully. We also encourage investors to get personal advice from your
+professional investment advisor and to make independent investigations before
+acting on information that we publish. Much of our information is derived
+directly from information published by companies or submitted to governmental
+agencies on which we believe are reliable but are without our independent verification.
+Therefore, we cannot assure you that the information is accurate or complete.
+We do not in any way whatsoever warrant or guarantee the success of any action
+you take in reliance on our statements or recommendations.
+"""
+
+
+GSHEETS_SCOPE = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive.file',
+    'https://www.googleapis.com/auth/drive']
+
+
+def google_credentials():
+    """ GOOGLE_CREDENTIALS service account json, parsed on first use """
+    global CREDENTIALS
+    if CREDENTIALS is None:
+        credentials = config('GOOGLE_CREDENTIALS', default='')
+        if not credentials:
+            raise Exception('GOOGLE_CREDENTIALS is required for sheets')
+        CREDENTIALS = json.loads(credentials)
+    return CREDENTIALS
+
+
+def create_gsheets_client():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(
+        google_credentials(), scopes=GSHEETS_SCOPE)
+    return gspread.authorize(creds)
+
+
+class ZillowScraperGsheets(ZillowScraper):
+    GSHEETS_SCOPE = GSHEETS_SCOPE
+
+    def __init__(self, zip_codes, share_email, verbose=False, client=None,
+                 sheet_pool=None, **kwargs):
+        super(ZillowScraperGsheets, self).__init__(zip_codes=zip_codes,
+                                                   verbose=verbose,
+                                                   **kwargs)
+        if client is None:
+            client = create_gsheets_client()
+        self.client = client
+        self.sheet_pool = sheet_pool
+        self.share_email = share_email
+        self.sheet = None
+        self.batch = SheetsBatch()
+        self.exported_zip_codes = []
+        self.api_calls = 0
+
+    @timed('sheets_api')
+    def call_api(self, method, *args, **kwargs):
+        self.api_calls += 1
+        return method(*args, **kwargs)
+
+    def create_disclaimer_worksheet(self, batch):
+        disclaimer = INFO.format(', '.join(self.exported_zip_codes))
+        batch.add_disclaimer(0, disclaimer.splitlines())
+
+    def fill_pooled_disclaimer(self, batch):
+        """ Pooled sheets already have the Info tab, only the first line
+        naming the zip codes is left to fill in """
+        disclaimer = INFO.format(', '.join(self.exported_zip_codes))
+        batch.update_values(0, [[disclaimer.splitlines()[0]]])
+
+    def create_data_worksheet(self, batch, properties_list):
+        rows = PropertyBatch.from_properties(properties_list).rows(
+            self.fieldnames)
+        batch.add_data_sheet(
+            self.zip_code,
+            'Provided to you by Engineered Cash Flow LLC, https://www.engineeredcashflow.com',
+            self.fieldnames,
+            rows)
+
+    @timed('sink_add')
+    def add_data_to_csv(self, properties_list):
+        # worksheets are only queued here, write_csv sends them in one batch
+        self.exported_zip_codes.append(self.zip_code)
+        self.create_data_worksheet(self.batch, properties_list)
+
+    @timed('sink_write')
+    def write_csv(self):
+        sheetname = 'zillow_data_{}_{}'.format(
+            datetime.datetime.now().strftime('%m_%d_%Y__%H_%M_%S'), '_'.join(self.zip_codes))
+        batch = SheetsBatch()
+        if self.sheet_pool is not None:
+            self.sheet = self.sheet_pool.take(self.client)
+        if self.sheet is not None:
+            self.api_calls += 1  # opening the pooled sheet
+            batch.rename_spreadsheet(sheetname)
+            self.fill_pooled_disclaimer(batch)
+        else:
+            self.sheet = self.call_api(self.client.create, sheetname)
+            self.create_disclaimer_worksheet(batch)
+        batch.requests.extend(self.batch.requests)
+        self.call_api(self.sheet.batch_update, batch.body())
+
+        print('Sharing with {}'.format(self.share_email))
+        self.call_api(
+            self.sheet.share,
+            self.share_email,
+            perm_type='user',
+            role='owner' if self.share_email.endswith(
+                '@gmail.com') else 'writer',
+            notify=True,
+            email_message='Here is your zip_code list from Engineered Cash Flow',
+            with_link=False)
+        print('Exported {} zip codes with {} sheets api calls'.format(
+            len(self.exported_zip_codes), self.api_calls))
+        self.sheet = None
+        self.batch = SheetsBatch()
+        self.exported_zip_codes = []
+
+
+def scrape_zillow_zipcode(zip_code, email, profile=False,
+                          profile_memory=False):
+    match = re.match(EMAIL_REGEX, email)
+    if not match:
+        return False
+    zsearch = ZillowScraperGsheets([zip_code], email)
+    if not profile:
+        zsearch.scrape()
+        return True
+    with RunProfile(trace_memory=profile_memory) as run_profile:
+        zsearch.scrape()
+    run_profile.print_report()
+    save_to_current_job(profile=run_profile.summary())
+    return True
@@ -0,0 +1,781 @@
+""" RQ jobs for the web app, with a shared redis result cache
+
+Identical zip code requests are coalesced: the first request claims the zip
+code and enqueues a single scrape, later requests for the same zip code only
+register their email with it. Once the scrape finishes the parsed properties
+are kept in redis so requests within ZILLOW_RESULT_TTL only need the Google
+Sheets export.
+
+Jobs are routed by cost on the high, default and low queues. A scrape starts
+with a probe of the first page on high, which tells how many pages the zip
+code has: small zip codes are finished right there, bigger ones are split
+into page range subjobs on default or low that workers run in parallel.
+Every scraped page is checkpointed, a subjob that failed or timed out is
+retried and only fetches the pages it didn't finish. The last subjob to
+finish merges the parts and enqueues the exports. The time from request to
+shared sheet is recorded per queue.
+"""
+import functools
+import json
+import math
+import re
+import rq
+import time
+import uuid
+
+from decouple import config
+
+import worker
+from src.checkpoints import RedisCheckpointStore
+from src.checkpoints import decode_properties, encode_properties
+from src.gsheets import ZillowScraperGsheets, create_gsheets_client
+from src.metrics import metrics, publish_summary
+from src.profiling import RunProfile, save_to_current_job
+from src.properties import PropertyIndex
+from src.sheet_pool import SheetPool
+from src.util import EMAIL_REGEX
+from src.zillow_scraper import ZillowScraperMemory
+
+ZILLOW_RESULT_TTL = config('ZILLOW_RESULT_TTL', default=3600, cast=int)
+# results of a scrape with failed pages are only kept for its exports
+PARTIAL_RESULT_TTL = config('PARTIAL_RESULT_TTL', default=600, cast=int)
+SCRAPE_JOB_TIMEOUT = config('SCRAPE_JOB_TIMEOUT', default=180, cast=int)
+EXPORT_JOB_TIMEOUT = config('EXPORT_JOB_TIMEOUT', default=60, cast=int)
+# seconds of job timeout per result page of a subjob
+PAGE_JOB_TIMEOUT = config('PAGE_JOB_TIMEOUT', default=20, cast=int)
+# zip codes up to SMALL_ZIP_PAGES pages go to high and are scraped by the
+# probe job, up to LARGE_ZIP_PAGES to default, bigger ones to low
+SMALL_ZIP_PAGES = config('SMALL_ZIP_PAGES', default=3, cast=int)
+LARGE_ZIP_PAGES = config('LARGE_ZIP_PAGES', default=10, cast=int)
+PAGES_PER_SUBJOB = config('PAGES_PER_SUBJOB', default=5, cast=int)
+# a subjob with failed pages is enqueued again, resuming from its checkpoint
+SUBJOB_RETRIES = config('SUBJOB_RETRIES', default=2, cast=int)
+PROPERTIES_PER_PAGE = 40
+MAX_BATCH_ZIP_CODES = config('MAX_BATCH_ZIP_CODES', default=100, cast=int)
+# waiters of a zip code scrape that are batches instead of emails
+BATCH_WAITER = 'batch:{}'
+# time to sheet samples kept per queue
+TIMINGS_KEPT = config('TIMINGS_KEPT', default=1000, cast=int)
+TIMINGS_KEY = 'zillow:timings:{}'
+
+
+def instrumented_job(func):
+    """ Collect the metrics of a job, log them and keep them in its meta.
+    Jobs enqueued with profile=True also keep their hot functions there. """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = kwargs.get('profile', False)
+        job = rq.get_current_job()
+        # jobs called inline by another job count towards that one
+        if (not (metrics.enabled or profile) or job is None
+                or job.func_name.rsplit('.', 1)[-1] != func.__name__):
+            return func(*args, **kwargs)
+        metrics.reset()
+        run_profile = RunProfile() if profile else None
+        try:
+            if run_profile is None:
+                return func(*args, **kwargs)
+            with run_profile:
+                return func(*args, **kwargs)
+        finally:
+            if metrics.enabled:
+                summary = metrics.log_summary(
+                    job=job.id, func=func.__name__, queue=job.origin)
+                job.meta['metrics'] = summary
+                publish_summary(worker.connection, summary)
+            if run_profile is not None:
+                run_profile.print_report()
+                job.meta['profile'] = run_profile.summary()
+            job.save_meta()
+    return wrapper
+
+
+def get_queue(name, connection=None):
+    return rq.Queue(name, connection=connection or worker.connection)
+
+
+def queue_for_pages(pages):
+    if pages <= SMALL_ZIP_PAGES:
+        return 'high'
+    if pages <= LARGE_ZIP_PAGES:
+        return 'default'
+    return 'low'
+
+
+class ResultStore(object):
+    """ Parsed properties per zip code and in flight scrape bookkeeping """
+    RESULTS_KEY = 'zillow:results:{}'
+    COUNT_KEY = 'zillow:count:{}'
+    INFLIGHT_KEY = 'zillow:inflight:{}'
+    WAITERS_KEY = 'zillow:waiters:{}'
+    PARTS_KEY = 'zillow:parts:{}'
+    REMAINING_KEY = 'zillow:remaining:{}'
+    FAILED_KEY = 'zillow:failed:{}'
+
+    def __init__(self, connection, ttl=ZILLOW_RESULT_TTL,
+                 inflight_ttl=SCRAPE_JOB_TIMEOUT * 2):
+        self.connection = connection
+        self.ttl = ttl
+        # a crashed scrape must not block the zip code forever
+        self.inflight_ttl = inflight_ttl
+
+    def has(self, zip_code):
+        return bool(self.connection.exists(self.RESULTS_KEY.format(zip_code)))
+
+    def encode(self, properties):
+        return encode_properties(properties)
+
+    def decode(self, data):
+        return decode_properties(data)
+
+    def get(self, zip_code):
+        data = self.connection.get(self.RESULTS_KEY.format(zip_code))
+        if data is None:
+            return None
+        return self.decode(data)
+
+    def count(self, zip_code):
+        """ Number of cached properties of zip_code, None if not cached """
+        count = self.connection.get(self.COUNT_KEY.format(zip_code))
+        return int(count) if count is not None else None
+
+    def put(self, zip_code, properties, ttl=None):
+        pipe = self.connection.pipeline()
+        pipe.set(self.RESULTS_KEY.format(zip_code), self.encode(properties),
+                 ex=ttl or self.ttl)
+        pipe.set(self.COUNT_KEY.format(zip_code), len(properties),
+                 ex=ttl or self.ttl)
+        pipe.execute()
+
+    def claim(self, zip_code, job_id):
+        """ True if job_id is now the one scrape in flight for zip_code """
+        return bool(self.connection.set(self.INFLIGHT_KEY.format(zip_code),
+                                        job_id,
+                                        nx=True,
+                                        ex=self.inflight_ttl))
+
+    def inflight_job_id(self, zip_code):
+        job_id = self.connection.get(self.INFLIGHT_KEY.format(zip_code))
+        return job_id.decode('utf8') if job_id else None
+
+    def extend_claim(self, zip_code, ttl):
+        """ Keep the claim (and its waiters) for a scrape of ttl seconds """
+        ttl = max(ttl, self.inflight_ttl)
+        pipe = self.connection.pipeline()
+        pipe.expire(self.INFLIGHT_KEY.format(zip_code), ttl)
+        pipe.expire(self.WAITERS_KEY.format(zip_code), ttl)
+        pipe.execute()
+
+    def claim_ttl(self, zip_code):
+        """ Seconds the claim of zip_code is kept, None without a claim """
+        ttl = self.connection.ttl(self.INFLIGHT_KEY.format(zip_code))
+        return ttl if ttl is not None and ttl > 0 else None
+
+    def release(self, zip_code):
+        self.connection.delete(self.INFLIGHT_KEY.format(zip_code))
+
+    def add_waiter(self, zip_code, email, requested_at):
+        key = self.WAITERS_KEY.format(zip_code)
+        pipe = self.connection.pipeline()
+        # a repeated request keeps the time of the first one
+        pipe.hsetnx(key, email, requested_at)
+        pipe.expire(key, self.inflight_ttl)
+        pipe.execute()
+
+    def pop_waiters(self, zip_code):
+        """ Returns (email, requested_at) of every waiter and forgets them """
+        key = self.WAITERS_KEY.format(zip_code)
+        pipe = self.connection.pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        waiters, _ = pipe.execute()
+        return [(email.decode('utf8'), float(requested_at))
+                for email, requested_at in waiters.items()]
+
+    def pop_batch_waiters(self, zip_code):
+        """ Like pop_waiters for the batches only, emails stay registered """
+        key = self.WAITERS_KEY.format(zip_code)
+        waiters = [(waiter.decode('utf8'), float(requested_at))
+                   for waiter, requested_at
+                   in self.connection.hgetall(key).items()]
+        waiters = [(waiter, requested_at) for waiter, requested_at in waiters
+                   if waiter.startswith(BATCH_WAITER.format(''))]
+        if waiters:
+            self.connection.hdel(key, *[waiter for waiter, _ in waiters])
+        return waiters
+
+    def start_parts(self, zip_code, parts, ttl):
+        """ Expect parts subjob results before zip_code can be merged """
+        pipe = self.connection.pipeline()
+        pipe.delete(self.PARTS_KEY.format(zip_code),
+                    self.FAILED_KEY.format(zip_code))
+        pipe.set(self.REMAINING_KEY.format(zip_code), parts, ex=ttl)
+        pipe.execute()
+
+    def put_part(self, zip_code, part, properties, failed=False):
+        """ Store the properties of a part, True if it was the last one """
+        parts_key = self.PARTS_KEY.format(zip_code)
+        pipe = self.connection.pipeline()
+        pipe.hset(parts_key, part, self.encode(properties))
+        pipe.expire(parts_key, self.inflight_ttl)
+        if failed:
+            pipe.set(self.FAILED_KEY.format(zip_code), 1, ex=self.inflight_ttl)
+        pipe.decr(self.REMAINING_KEY.format(zip_code))
+        return pipe.execute()[-1] <= 0
+
+    def pop_parts(self, zip_code):
+        """ Returns (properties of every part in order, True if a part
+        failed) and forgets the parts """
+        pipe = self.connection.pipeline()
+        pipe.hgetall(self.PARTS_KEY.format(zip_code))
+        pipe.get(self.FAILED_KEY.format(zip_code))
+        pipe.delete(self.PARTS_KEY.format(zip_code),
+                    self.REMAINING_KEY.format(zip_code),
+                    self.FAILED_KEY.format(zip_code))
+        parts, failed, _ = pipe.execute()
+        properties = []
+        for part in sorted(parts, key=int):
+            properties.extend(self.decode(parts[part]))
+        return properties, failed is not None
+
+
+class BatchStore(object):
+    """ Zip codes of a batch that are still being scraped """
+    BATCH_KEY = 'zillow:batch:{}'
+    REMAINING_KEY = 'zillow:batch:{}:remaining'
+    FAILED_KEY = 'zillow:batch:{}:failed'
+
+    def __init__(self, connection, ttl=ZILLOW_RESULT_TTL):
+        self.connection = connection
+        self.ttl = ttl
+
+    def create(self, email, zip_codes, pending, requested_at):
+        batch_id = str(uuid.uuid4())
+        pipe = self.connection.pipeline()
+        pipe.hmset(self.BATCH_KEY.format(batch_id), {
+            'email': email,
+            'zip_codes': json.dumps(zip_codes),
+            'requested_at': requested_at})
+        pipe.expire(self.BATCH_KEY.format(batch_id), self.ttl)
+        if pending:
+            pipe.sadd(self.REMAINING_KEY.format(batch_id), *pending)
+            pipe.expire(self.REMAINING_KEY.format(batch_id), self.ttl)
+        pipe.execute()
+        return batch_id
+
+    def get(self, batch_id):
+        batch = self.connection.hgetall(self.BATCH_KEY.format(batch_id))
+        if not batch:
+            return None
+        batch = {key.decode('utf8'): value.decode('utf8')
+                 for key, value in batch.items()}
+        batch['zip_codes'] = json.loads(batch['zip_codes'])
+        batch['requested_at'] = float(batch['requested_at'])
+        batch['remaining'] = sorted(
+            zip_code.decode('utf8') for zip_code in self.connection.smembers(
+                self.REMAINING_KEY.format(batch_id)))
+        batch['failed'] = sorted(
+            zip_code.decode('utf8') for zip_code in self.connection.smembers(
+                self.FAILED_KEY.format(batch_id)))
+        return batch
+
+    def finish_zip_code(self, batch_id, zip_code, failed=False):
+        """ True if zip_code was the last one the batch waited for """
+        pipe = self.connection.pipeline()
+        if failed:
+            pipe.sadd(self.FAILED_KEY.format(batch_id), zip_code)
+            pipe.expire(self.FAILED_KEY.format(batch_id), self.ttl)
+        pipe.srem(self.REMAINING_KEY.format(batch_id), zip_code)
+        pipe.scard(self.REMAINING_KEY.format(batch_id))
+        removed, remaining = pipe.execute()[-2:]
+        return bool(removed) and remaining == 0
+
+    def set_export_job(self, batch_id, job_id):
+        self.connection.hset(self.BATCH_KEY.format(batch_id),
+                             'export_job_id', job_id)
+
+
+class ScrapeProgress(object):
+    """ Pages and listings of the scrape of a zip code so far, for status
+    polling, and its listings as json lines for streaming """
+    PROGRESS_KEY = 'zillow:progress:{}'
+    STREAM_KEY = 'zillow:stream:{}'
+    FIELDS = ('pages_total', 'pages_parsed', 'pages_failed', 'listings',
+              'sheets_shared')
+    # stages after which no more listings are streamed
+    FINAL_STAGES = ('exporting', 'failed')
+
+    def __init__(self, connection, ttl=ZILLOW_RESULT_TTL):
+        self.connection = connection
+        self.ttl = ttl
+
+    def set_stage(self, zip_code, stage, **fields):
+        key = self.PROGRESS_KEY.format(zip_code)
+        pipe = self.connection.pipeline()
+        pipe.hmset(key, dict(fields, stage=stage))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def start(self, zip_code, pages_total):
+        pipe = self.connection.pipeline()
+        pipe.delete(self.PROGRESS_KEY.format(zip_code),
+                    self.STREAM_KEY.format(zip_code))
+        pipe.execute()
+        self.set_stage(zip_code, 'scraping', pages_total=pages_total)
+
+    def add_page(self, zip_code, properties):
+        key = self.PROGRESS_KEY.format(zip_code)
+        stream_key = self.STREAM_KEY.format(zip_code)
+        pipe = self.connection.pipeline()
+        pipe.hincrby(key, 'pages_parsed', 1)
+        pipe.hincrby(key, 'listings', len(properties))
+        if properties:
+            pipe.rpush(stream_key, *[json.dumps(prop.to_dict())
+                                     for prop in properties])
+            pipe.expire(stream_key, self.ttl)
+        pipe.execute()
+
+    def add(self, zip_code, field, value=1):
+        self.connection.hincrby(self.PROGRESS_KEY.format(zip_code), field, value)
+
+    def get(self, zip_code):
+        progress = {key.decode('utf8'): value.decode('utf8') for key, value in
+                    self.connection.hgetall(
+                        self.PROGRESS_KEY.format(zip_code)).items()}
+        for field in self.FIELDS:
+            progress[field] = int(progress.get(field, 0))
+        return progress
+
+    def listings(self, zip_code, start=0):
+        """ Json lines of the listings streamed from index start on """
+        return [line.decode('utf8') for line in self.connection.lrange(
+            self.STREAM_KEY.format(zip_code), start, -1)]
+
+
+class ZillowScraperProgress(ZillowScraperMemory):
+    """ ZillowScraperMemory reporting every parsed page to ScrapeProgress """
+
+    def __init__(self, zip_codes, progress, **kwargs):
+        super(ZillowScraperProgress, self).__init__(zip_codes, **kwargs)
+        self.progress = progress
+
+    def add_properties(self, zip_code, properties):
+        super(ZillowScraperProgress, self).add_properties(zip_code, properties)
+        self.progress.add_page(zip_code, properties)
+
+
+def record_time_to_sheet(connection, queue_name, seconds):
+    key = TIMINGS_KEY.format(queue_name)
+    pipe = connection.pipeline()
+    pipe.lpush(key, seconds)
+    pipe.ltrim(key, 0, TIMINGS_KEPT - 1)
+    pipe.execute()
+
+
+def percentile(values, fraction):
+    """ Nearest rank percentile of sorted values """
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+def queue_timings(connection):
+    """ p50 / p95 seconds from request to shared sheet per queue """
+    timings = {}
+    for queue_name in worker.listen:
+        values = sorted(float(value) for value in connection.lrange(
+            TIMINGS_KEY.format(queue_name), 0, -1))
+        timings[queue_name] = {
+            'count': len(values),
+            'p50': percentile(values, 0.5) if values else None,
+            'p95': percentile(values, 0.95) if values else None,
+        }
+    return timings
+
+
+def enqueue_zipcode(connection, zip_code, email, profile=False):
+    """ Returns the job that will deliver a sheet for zip_code to email """
+    store = ResultStore(connection)
+    requested_at = time.time()
+    count = store.count(zip_code)
+    if count is not None:
+        pages = int(math.ceil(count / float(PROPERTIES_PER_PAGE)))
+        return get_queue(queue_for_pages(pages), connection).enqueue(
+            export_zillow_zipcode,
+            job_timeout=EXPORT_JOB_TIMEOUT,
+            description='Exporting cached zipcode {} for {}'.format(
+                zip_code, email),
+            args=(zip_code, email, requested_at),
+            kwargs={'profile': profile})
+    return enqueue_scrape(connection, zip_code, email, requested_at, profile)
+
+
+def enqueue_scrape(connection, zip_code, waiter, requested_at, profile=False):
+    """ Registers waiter (an email or a batch) for the scrape of zip_code,
+    starting one if none is in flight. Returns the scrape job. """
+    store = ResultStore(connection)
+    # register first so a scrape finishing right now still sees the waiter
+    store.add_waiter(zip_code, waiter, requested_at)
+    job_id = str(uuid.uuid4())
+    if store.claim(zip_code, job_id):
+        return get_queue('high', connection).enqueue(
+            plan_zillow_zipcode,
+            job_id=job_id,
+            job_timeout=SCRAPE_JOB_TIMEOUT,
+            description='Probing zipcode {}'.format(zip_code),
+            args=(zip_code,),
+            kwargs={'profile': profile})
+    print('Attached {} to the scrape in flight for {}'.format(
+        waiter, zip_code))
+    return get_queue('high', connection).fetch_job(
+        store.inflight_job_id(zip_code) or job_id)
+
+
+def enqueue_batch(connection, zip_codes, email, profile=False):
+    """ Scrape every zip code in parallel and share them in one spreadsheet
+    once the last one is done. Returns (batch id, zip code -> scrape job) """
+    if len(zip_codes) > MAX_BATCH_ZIP_CODES:
+        raise ValueError('At most {} zip codes per batch'.format(
+            MAX_BATCH_ZIP_CODES))
+    zip_codes = list(dict.fromkeys(zip_codes))
+    store = ResultStore(connection)
+    batches = BatchStore(connection)
+    requested_at = time.time()
+    pending = [zip_code for zip_code in zip_codes if not store.has(zip_code)]
+    batch_id = batches.create(email, zip_codes, pending, requested_at)
+    if not pending:
+        enqueue_batch_export(connection, batch_id)
+    jobs = {}
+    for zip_code in pending:
+        jobs[zip_code] = enqueue_scrape(connection, zip_code,
+                                        BATCH_WAITER.format(batch_id),
+                                        requested_at, profile)
+    return batch_id, jobs
+
+
+def enqueue_batch_export(connection, batch_id):
+    job = get_queue('default', connection).enqueue(
+        export_zillow_batch,
+        job_timeout=EXPORT_JOB_TIMEOUT * 2,
+        description='Exporting batch {}'.format(batch_id),
+        args=(batch_id,))
+    BatchStore(connection).set_export_job(batch_id, job.id)
+    return job
+
+
+def notify_waiters(zip_code, queue_name, failed=False):
+    """ Enqueue a sheet for every email waiting on zip_code and tell waiting
+    batches it is done. When the scrape failed only the batches are told,
+    emails stay registered for the next scrape of zip_code. Returns the
+    number of waiters notified. """
+    store = ResultStore(worker.connection)
+    batches = BatchStore(worker.connection)
+    queue = get_queue(queue_name)
+    if failed:
+        waiters = store.pop_batch_waiters(zip_code)
+    else:
+        waiters = store.pop_waiters(zip_code)
+    for waiter, requested_at in waiters:
+        if waiter.startswith(BATCH_WAITER.format('')):
+            batch_id = waiter[len(BATCH_WAITER.format('')):]
+            if batches.finish_zip_code(batch_id, zip_code, failed=failed):
+                enqueue_batch_export(worker.connection, batch_id)
+        else:
+            queue.enqueue(
+                export_zillow_zipcode,
+                job_timeout=EXPORT_JOB_TIMEOUT,
+                description='Exporting zipcode {} for {}'.format(
+                    zip_code, waiter),
+                args=(zip_code, waiter, requested_at))
+    return len(waiters)
+
+
+def get_zipcode_results(store, zip_code):
+    """ Cached properties of zip_code, scraping and caching them if needed """
+    properties = store.get(zip_code)
+    if properties is not None:
+        print('Using cached results for {}'.format(zip_code))
+        return properties
+    zsearch = ZillowScraperMemory([zip_code])
+    zsearch.scrape()
+    properties = zsearch.results.get(zip_code, [])
+    store.put(zip_code, properties)
+    return properties
+
+
+def export_zipcode(zip_code, email, properties):
+    if not re.match(EMAIL_REGEX, email):
+        print('Skipping invalid email {}'.format(email))
+        return False
+    pool = SheetPool(worker.connection)
+    zsearch = ZillowScraperGsheets(
+        [zip_code], email, sheet_pool=pool if pool.enabled else None)
+    zsearch.export({zip_code: properties})
+    schedule_sheet_pool_refill(pool)
+    return True
+
+
+def schedule_sheet_pool_refill(pool):
+    if pool.should_refill():
+        rq.Queue('low', connection=pool.connection).enqueue(
+            refill_sheet_pool,
+            job_timeout=EXPORT_JOB_TIMEOUT * pool.refill_batch,
+            description='Refilling the spreadsheet pool')
+
+
+@instrumented_job
+def refill_sheet_pool():
+    """ Job: create spreadsheets until the pool is full again """
+    pool = SheetPool(worker.connection)
+    created = pool.refill(create_gsheets_client())
+    print('Added {} spreadsheets to the pool, {} available'.format(
+        created, pool.available()))
+    return created
+
+
+@instrumented_job
+def export_zillow_zipcode(zip_code, email, requested_at=None, profile=False):
+    """ Job: export the cached results of zip_code to a new sheet """
+    store = ResultStore(worker.connection)
+    exported = export_zipcode(zip_code, email,
+                              get_zipcode_results(store, zip_code))
+    if exported:
+        ScrapeProgress(worker.connection).add(zip_code, 'sheets_shared')
+    job = rq.get_current_job()
+    if exported and requested_at is not None and job is not None:
+        record_time_to_sheet(worker.connection, job.origin,
+                             time.time() - requested_at)
+    return exported
+
+
+@instrumented_job
+def export_zillow_batch(batch_id, profile=False):
+    """ Job: share the results of every zip code of a batch in one sheet """
+    batch = BatchStore(worker.connection).get(batch_id)
+    if batch is None:
+        raise Exception('Batch {} expired'.format(batch_id))
+    if not re.match(EMAIL_REGEX, batch['email']):
+        print('Skipping invalid email {}'.format(batch['email']))
+        return False
+    store = ResultStore(worker.connection)
+    properties_by_zip = {}
+    for zip_code in batch['zip_codes']:
+        properties = store.get(zip_code)
+        if properties is None:
+            print('No results for {} of batch {}'.format(zip_code, batch_id))
+            continue
+        properties_by_zip[zip_code] = properties
+    if not properties_by_zip:
+        raise Exception('No results for any zip code of batch {}'.format(
+            batch_id))
+
+    pool = SheetPool(worker.connection)
+    zsearch = ZillowScraperGsheets(
+        list(properties_by_zip), batch['email'],
+        sheet_pool=pool if pool.enabled else None)
+    zsearch.export(properties_by_zip)
+    schedule_sheet_pool_refill(pool)
+    job = rq.get_current_job()
+    if job is not None:
+        record_time_to_sheet(worker.connection, job.origin,
+                             time.time() - batch['requested_at'])
+    return len(properties_by_zip)
+
+
+@instrumented_job
+def plan_zillow_zipcode(zip_code, profile=False):
+    """ Job: probe the first page of zip_code and split the remaining pages
+    into subjobs on the queue matching its size """
+    store = ResultStore(worker.connection)
+    progress = ScrapeProgress(worker.connection)
+    progress.set_stage(zip_code, 'probing')
+    try:
+        zsearch = ZillowScraperMemory([zip_code])
+        properties, page_urls = zsearch.probe_zip_code(zip_code)
+    except BaseException:
+        store.release(zip_code)
+        progress.set_stage(zip_code, 'failed')
+        # batches go on without this zip code
+        notify_waiters(zip_code, 'high', failed=True)
+        raise
+
+    page_urls = sorted(page_urls)
+    pages = len(page_urls) + 1
+    queue_name = queue_for_pages(pages)
+    progress.start(zip_code, pages)
+    progress.add_page(zip_code, properties)
+    save_to_current_job(zip_code=zip_code, pages=pages, queue=queue_name)
+    if pages <= SMALL_ZIP_PAGES:
+        chunks = [page_urls] if page_urls else []
+    else:
+        chunks = [page_urls[i:i + PAGES_PER_SUBJOB]
+                  for i in range(0, len(page_urls), PAGES_PER_SUBJOB)]
+    print('{} has {} pages, {} subjobs on {}'.format(
+        zip_code, pages, len(chunks), queue_name))
+
+    # subjobs may wait behind each other on one worker, and be retried
+    ttl = SCRAPE_JOB_TIMEOUT + PAGE_JOB_TIMEOUT * pages * (1 + SUBJOB_RETRIES)
+    store.extend_claim(zip_code, ttl)
+    store.start_parts(zip_code, len(chunks) + 1, ttl)
+    # pages of an earlier scrape are not resumed
+    RedisCheckpointStore(worker.connection).clear(zip_code)
+    if store.put_part(zip_code, 0, properties):
+        return merge_zillow_parts(zip_code, queue_name)
+    if pages <= SMALL_ZIP_PAGES:
+        # not worth a queue round trip
+        return scrape_zillow_pages(zip_code, 1, chunks[0], queue_name,
+                                   profile=profile)
+
+    for part, chunk in enumerate(chunks, 1):
+        enqueue_pages(zip_code, part, chunk, queue_name, profile=profile)
+    return len(chunks)
+
+
+def enqueue_pages(zip_code, part, page_urls, queue_name, attempt=0,
+                  profile=False):
+    return get_queue(queue_name).enqueue(
+        scrape_zillow_pages,
+        job_timeout=PAGE_JOB_TIMEOUT * len(page_urls) + EXPORT_JOB_TIMEOUT,
+        description='Scraping pages {}-{} of zipcode {}{}'.format(
+            page_urls[0][0], page_urls[-1][0], zip_code,
+            ' (retry {})'.format(attempt) if attempt else ''),
+        args=(zip_code, part, page_urls, queue_name),
+        kwargs={'attempt': attempt, 'profile': profile})
+
+
+@instrumented_job
+def scrape_zillow_pages(zip_code, part, page_urls, queue_name, attempt=0,
+                        profile=False):
+    """ Job: scrape a page range of zip_code, the last part merges them.
+    Pages found in the checkpoint are not fetched again, a part with failed
+    pages is retried up to SUBJOB_RETRIES times before it counts as failed.
+    """
+    store = ResultStore(worker.connection)
+    checkpoints = RedisCheckpointStore(worker.connection, ttl=store.ttl)
+    checkpoint = checkpoints.load(zip_code)
+    properties = []
+    for page, _ in page_urls:
+        properties.extend(checkpoint.pages.get(page, []))
+    remaining = checkpoint.remaining(page_urls)
+    if len(remaining) < len(page_urls):
+        print('Resuming part {} of {}: {} of {} pages checkpointed'.format(
+            part, zip_code, len(page_urls) - len(remaining), len(page_urls)))
+    # every page counts as failed if the scrape raises
+    failed_pages = dict(remaining)
+    progress = ScrapeProgress(worker.connection)
+    try:
+        zsearch = ZillowScraperProgress([zip_code], progress,
+                                        checkpoints=checkpoints)
+        failed_pages = zsearch.scrape_pages(zip_code, remaining)
+        properties.extend(zsearch.results.get(zip_code, []))
+    finally:
+        last = False
+        if failed_pages and attempt < SUBJOB_RETRIES:
+            print('Retrying {} failed pages of part {} of {}'.format(
+                len(failed_pages), part, zip_code))
+            enqueue_pages(zip_code, part, page_urls, queue_name,
+                          attempt=attempt + 1, profile=profile)
+        else:
+            if failed_pages:
+                progress.add(zip_code, 'pages_failed', len(failed_pages))
+            # count the part even if it failed so the merge still happens
+            last = store.put_part(zip_code, part, properties,
+                                  failed=bool(failed_pages))
+    if last:
+        return merge_zillow_parts(zip_code, queue_name)
+    return len(properties)
+
+
+def merge_zillow_parts(zip_code, queue_name):
+    """ Cache the merged parts and enqueue a sheet for every waiting email """
+    store = ResultStore(worker.connection)
+    properties, failed = store.pop_parts(zip_code)
+    # pages of different parts can overlap when listings move
+    properties = PropertyIndex().filter(properties, zip_code)
+    store.put(zip_code, properties,
+              ttl=PARTIAL_RESULT_TTL if failed else None)
+    store.release(zip_code)
+    RedisCheckpointStore(worker.connection).clear(zip_code)
+    ScrapeProgress(worker.connection).set_stage(
+        zip_code, 'exporting', listings=len(properties))
+    if failed:
+        print('Some pages of {} failed, not caching it for long'.format(
+            zip_code))
+
+    return notify_waiters(zip_code, queue_name)
+
+
+def job_status(connection, job_id):
+    """ Status and scrape progress of a job returned by enqueue_zipcode,
+    None if the job doesn't exist (anymore) """
+    try:
+        job = rq.job.Job.fetch(job_id, connection=connection)
+    except rq.exceptions.NoSuchJobError:
+        return None
+    if job.func_name.endswith('export_zillow_batch'):
+        zip_code = None
+    else:
+        # every zip code job takes the zip code first
+        zip_code = job.args[0] if job.args else None
+    status = {
+        'job_id': job.id,
+        'status': job.get_status(),
+        'zip_code': zip_code,
+        'meta': job.meta,
+    }
+    if zip_code is not None:
+        status['progress'] = ScrapeProgress(connection).get(zip_code)
+        status['cached'] = ResultStore(connection).has(zip_code)
+    if job.is_failed:
+        status['error'] = (job.exc_info or '').strip().splitlines()[-1:]
+    return status
+
+
+def stream_listings(connection, zip_code, start=0, poll_interval=0.5):
+    """ Yield the json line of every listing of zip_code from index start on
+    as it is parsed, or the cached results when there is no scrape to
+    follow. The stream follows the scrape for as long as it holds its claim
+    and always ends with a {"done": ..., "stage": ..., "next": ...} line,
+    next being the start to resume a stream that wasn't done from. """
+    progress = ScrapeProgress(connection)
+    store = ResultStore(connection)
+    stage = progress.get(zip_code).get('stage')
+    if not stage:
+        properties = store.get(zip_code) or []
+        for prop in properties[start:]:
+            yield json.dumps(prop.to_dict())
+        yield json.dumps({'done': True, 'stage': None,
+                          'next': max(start, len(properties))})
+        return
+    sent = start
+    deadline = time.time()
+    while True:
+        # read the stage first so no listing added before it is missed
+        stage = progress.get(zip_code).get('stage')
+        done = stage in ScrapeProgress.FINAL_STAGES
+        lines = progress.listings(zip_code, sent)
+        for line in lines:
+            yield line
+        sent += len(lines)
+        # the plan job extends the claim to cover every subjob of the scrape
+        claim_ttl = store.claim_ttl(zip_code)
+        if claim_ttl is not None:
+            deadline = time.time() + claim_ttl
+        if done or time.time() > deadline:
+            break
+        time.sleep(poll_interval)
+    yield json.dumps({'done': done, 'stage': stage, 'next': sent})
+
+
+def batch_status(connection, batch_id):
+    """ Zip codes a batch still waits for and its export job, None if the
+    batch doesn't exist (anymore) """
+    batch = BatchStore(connection).get(batch_id)
+    if batch is None:
+        return None
+    progress = ScrapeProgress(connection)
+    batch['batch_id'] = batch_id
+    batch['progress'] = {zip_code: progress.get(zip_code)
+                         for zip_code in batch['remaining']}
+    export_job_id = batch.get('export_job_id')
+    if export_job_id:
+        batch['export'] = job_status(connection, export_job_id)
+    return batch
@@ -0,0 +1,136 @@
+""" Per stage timers and counters of the scrape pipeline
+
+Instrumented functions are wrapped with @timed, which only costs a flag
+check while metrics are disabled. A run (or rq job) ends with summary():
+count, total and max seconds of every timer plus the counters. Workers also
+add their summaries to a redis hash that the web app renders for Prometheus.
+"""
+import functools
+import json
+import threading
+import time
+
+from decouple import config
+
+METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+METRICS_KEY = 'zillow:metrics'
+
+
+class Metrics(object):
+    """ Thread safe timers and counters of one process """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # name -> [count, total seconds, max seconds]
+            self.timers = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def add(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def summary(self, **fields):
+        """ Dict of everything recorded since the last reset """
+        with self.lock:
+            summary = dict(fields)
+            summary['elapsed'] = round(time.time() - self.started, 4)
+            summary['timers'] = {
+                name: {'count': count,
+                       'total': round(total, 4),
+                       'max': round(longest, 4)}
+                for name, (count, total, longest) in sorted(self.timers.items())}
+            summary['counters'] = dict(sorted(self.counters.items()))
+        return summary
+
+    def log_summary(self, **fields):
+        """ Print the summary as one json line, returns it """
+        summary = self.summary(**fields)
+        print(json.dumps(dict(event='metrics', **summary), sort_keys=True))
+        return summary
+
+
+class Timer(object):
+    """ Context manager adding the time spent in its block to a timer """
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.monotonic() - self.start)
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    """ Decorator recording every call of the function under name """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.monotonic() - start)
+        return wrapper
+    return decorator
+
+
+def publish_summary(connection, summary):
+    """ Add a job summary to the totals shared by every worker """
+    pipe = connection.pipeline()
+    pipe.hincrby(METRICS_KEY, 'jobs', 1)
+    for name, timer in summary['timers'].items():
+        pipe.hincrby(METRICS_KEY, '{}_count'.format(name), timer['count'])
+        pipe.hincrbyfloat(METRICS_KEY, '{}_seconds'.format(name), timer['total'])
+    for name, value in summary['counters'].items():
+        pipe.hincrbyfloat(METRICS_KEY, name, value)
+    pipe.execute()
+
+
+def prometheus_text(connection):
+    """ Totals of publish_summary in the Prometheus text format """
+    totals = connection.hgetall(METRICS_KEY)
+    lines = []
+    for field, value in sorted(totals.items()):
+        field = field.decode('utf8')
+        if field.endswith('_seconds'):
+            metric = 'zillow_{}_total'.format(field)
+        elif field.endswith('_count'):
+            metric = 'zillow_{}_total'.format(field[:-len('_count')] + '_calls')
+        else:
+            metric = 'zillow_{}_total'.format(field)
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, float(value)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,94 @@
+""" cProfile and optional tracemalloc around a single scrape run
+
+Only the thread that starts the profile is traced: time spent waiting on
+page downloads shows up under fetch_pages / wait, parsing, json decoding and
+sinks run in that thread and show up as themselves.
+"""
+import cProfile
+import os
+import pstats
+import tracemalloc
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 15
+
+
+def function_name(key):
+    filename, line, name = key
+    if filename == '~':
+        # built in, e.g. lxml.etree.fromstring or json.loads internals
+        return name
+    return '{}:{}({})'.format(os.path.basename(filename), line, name)
+
+
+class RunProfile(object):
+    """ Context manager profiling its block, stats are dumped to path """
+
+    def __init__(self, path=None, trace_memory=False, top=TOP_FUNCTIONS):
+        self.path = path
+        self.trace_memory = trace_memory
+        self.top = top
+        self.profiler = cProfile.Profile()
+        self.snapshot = None
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        if self.trace_memory:
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        if self.path:
+            self.profiler.dump_stats(self.path)
+
+    def hot_functions(self):
+        """ Functions with the most time spent in their own code """
+        stats = pstats.Stats(self.profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+        return [{'function': function_name(key),
+                 'calls': calls,
+                 'own_seconds': round(own, 4),
+                 'cumulative_seconds': round(cumulative, 4)}
+                for key, (_, calls, own, cumulative, _) in rows[:self.top]]
+
+    def top_allocations(self):
+        if self.snapshot is None:
+            return []
+        return [{'line': str(stat.traceback[0]),
+                 'size': stat.size,
+                 'count': stat.count}
+                for stat in self.snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+
+    def summary(self):
+        """ Json serializable report, small enough for the rq job meta """
+        return {'path': self.path,
+                'functions': self.hot_functions(),
+                'allocations': self.top_allocations()}
+
+    def print_report(self):
+        print('{:>10} {:>10} {:>10}  {}'.format(
+            'calls', 'own s', 'cum s', 'function'))
+        for row in self.hot_functions():
+            print('{calls:>10} {own_seconds:>10.3f} {cumulative_seconds:>10.3f}'
+                  '  {function}'.format(**row))
+        for row in self.top_allocations():
+            print('{:>10.1f} kB {:>8} blocks  {}'.format(
+                row['size'] / 1024.0, row['count'], row['line']))
+        if self.path:
+            print('Profile saved to {}'.format(self.path))
+
+
+def save_to_current_job(**meta):
+    """ Keep meta in the running rq job, if any """
+    # rq isn't needed to profile command line runs
+    import rq
+
+    job = rq.get_current_job()
+    if job is None:
+        return
+    job.meta.update(meta)
+    job.save_meta()
@@ -1,73 +1,249 @@
+import math
+import re
+
+from array import array
+from lxml import etree
+
 from src.urls import ZILLOW_URL
 from src.util import clean
 
+ZPID_REGEX = re.compile(r'(\d+)_zpid')
+NUMBER_REGEX = re.compile(r'(\d[\d,]*(?:\.\d+)?)\s*([kKmM]?)')
+MULTIPLIERS = {'': 1, 'k': 1000, 'm': 1000000}
+
+# per card xpaths, compiled once instead of for every listing
+CARD_ADDRESS_XPATH = etree.XPath('.//h3[@class="list-card-addr"]//text()')
+CARD_PRICE_XPATH = etree.XPath('.//div[@class="list-card-price"]//text()')
+CARD_BROKER_XPATH = etree.XPath('.//div[@class="list-card-truncate"]//text()')
+CARD_FOR_SALE_XPATH = etree.XPath('.//span[@class="zsg-icon-for-sale"]')
+CARD_DAYS_XPATH = etree.XPath(
+    './/div[@class="list-card-top"]//div[@class="list-card-variable-text list-card-img-overlay"]//text()')
+
+
+def parse_number(value, cast=int):
+    """ Parse '$1,250,000', '1.2M', '3 bds' or 42 into a number, None if missing """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return cast(value)
+    try:
+        # fast path for the common '$350,000' style
+        return cast(value.replace('$', '').replace(',', ''))
+    except (AttributeError, ValueError):
+        pass
+    match = NUMBER_REGEX.search(str(value))
+    if not match:
+        return None
+    number = float(match.group(1).replace(',', ''))
+    return cast(number * MULTIPLIERS[match.group(2).lower()])
+
 
 class Property(object):
+    """ Compact listing record, numeric fields are parsed once on construction
+
+    price, bedrooms, area and days_on_zillow are ints and bathrooms is a
+    float, all of them None when zillow doesn't provide them.
+    """
+    __slots__ = ('address',
+                 'city',
+                 'state',
+                 'postal_code',
+                 'price',
+                 'info',
+                 'broker',
+                 'title',
+                 'property_url',
+                 'is_forsale',
+                 'bathrooms',
+                 'bedrooms',
+                 'area',
+                 'days_on_zillow',
+                 'zpid',
+                 'change')
 
     def __init__(self):
         self.address = ''
         self.city = ''
         self.state = ''
         self.postal_code = ''
-        self.price = ''
+        self.price = None
         self.info = ''
         self.broker = ''
         self.title = ''
         self.property_url = ''
         self.is_forsale = True
-        self.bathrooms = ''
-        self.bedrooms = ''
-        self.property_info = ''
-        self.area = ''
-        self.days_on_zillow = ''
+        self.bathrooms = None
+        self.bedrooms = None
+        self.area = None
+        self.days_on_zillow = None
+        self.zpid = ''
+        # set by incremental runs: new, price_changed, ... or removed
+        self.change = ''
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in Property.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        prop = Property()
+        for field in Property.__slots__:
+            if field in data:
+                setattr(prop, field, data[field])
+        return prop
+
+    def values(self, fieldnames):
+        """ Field values in fieldnames order, missing values as '' """
+        row = []
+        for field in fieldnames:
+            value = getattr(self, field)
+            row.append('' if value is None else value)
+        return row
+
+    @property
+    def listing_key(self):
+        """ Stable identity of the listing used for de-duplication """
+        if self.zpid:
+            return 'zpid:{}'.format(self.zpid)
+        match = ZPID_REGEX.search(self.property_url or '')
+        if match:
+            return 'zpid:{}'.format(match.group(1))
+        return 'address:{}'.format(normalize_address(self.address))
+
+
+def normalize_address(address):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', address or '').lower().split())
+
+
+class PropertyIndex(object):
+    """ Run wide index of listings already handed to a sink """
+
+    def __init__(self):
+        self.keys = set()
+        self.duplicates = {}
+
+    def add(self, prop, zip_code=''):
+        """ Returns True the first time a listing is seen """
+        key = prop.listing_key
+        if key in self.keys:
+            self.duplicates[zip_code] = self.duplicates.get(zip_code, 0) + 1
+            return False
+        self.keys.add(key)
+        return True
+
+    def filter(self, properties, zip_code=''):
+        return [prop for prop in properties if self.add(prop, zip_code)]
+
+
+class PropertyBatch(object):
+    """ Columnar form of a list of properties, one array or list per field
+
+    Numeric columns are stored in typed arrays with MISSING (ints) or nan
+    (floats) for absent values so sinks and analysis code can work on whole
+    columns without touching individual Property objects.
+    """
+    MISSING = -1
+    INT_FIELDS = ('price', 'bedrooms', 'area', 'days_on_zillow')
+    FLOAT_FIELDS = ('bathrooms',)
+
+    def __init__(self):
+        self.columns = {}
+        for field in Property.__slots__:
+            if field in self.INT_FIELDS:
+                self.columns[field] = array('q')
+            elif field in self.FLOAT_FIELDS:
+                self.columns[field] = array('d')
+            else:
+                self.columns[field] = []
+        self.size = 0
+
+    @classmethod
+    def from_properties(cls, properties):
+        batch = cls()
+        batch.extend(properties)
+        return batch
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, properties):
+        for field, column in self.columns.items():
+            if field in self.INT_FIELDS:
+                column.extend(self.MISSING if value is None else value
+                              for value in (getattr(p, field) for p in properties))
+            elif field in self.FLOAT_FIELDS:
+                column.extend(math.nan if value is None else value
+                              for value in (getattr(p, field) for p in properties))
+            else:
+                column.extend(getattr(p, field) for p in properties)
+        self.size += len(properties)
+
+    def column(self, field, missing=None):
+        """ Column values with absent numbers replaced by missing """
+        column = self.columns[field]
+        if field in self.INT_FIELDS:
+            return [missing if value == self.MISSING else value for value in column]
+        if field in self.FLOAT_FIELDS:
+            return [missing if math.isnan(value) else value for value in column]
+        return list(column)
+
+    def rows(self, fieldnames, missing=''):
+        """ Iterate over rows of values in fieldnames order """
+        columns = [self.column(field, missing) for field in fieldnames]
+        return zip(*columns)
 
 
 class ZillowPropertyHtml(Property):
+    __slots__ = ()
 
     def __init__(self, html_elements, json_elements):
         super(ZillowPropertyHtml, self).__init__()
-        raw_address = html_elements.xpath(
-            './/h3[@class="list-card-addr"]//text()')
-        raw_price = html_elements.xpath(
-            './/div[@class="list-card-price"]//text()')
-        raw_broker_name = html_elements.xpath(
-            './/div[@class="list-card-truncate"]//text()')
-        if html_elements.xpath('.//span[@class="zsg-icon-for-sale"]'):
+        raw_address = CARD_ADDRESS_XPATH(html_elements)
+        raw_price = CARD_PRICE_XPATH(html_elements)
+        raw_broker_name = CARD_BROKER_XPATH(html_elements)
+        if CARD_FOR_SALE_XPATH(html_elements):
             self.is_forsale = True
-        maybe_days_on_zillow = html_elements.xpath(
-            './/div[@class="list-card-top"]//div[@class="list-card-variable-text list-card-img-overlay"]//text()')[0]
+        maybe_days_on_zillow = CARD_DAYS_XPATH(html_elements)[0]
         if 'days on Zillow' in maybe_days_on_zillow:
-            self.days_on_zillow = int(maybe_days_on_zillow.split()[0])
+            self.days_on_zillow = parse_number(maybe_days_on_zillow)
         address_node = json_elements.get('address')
 
         self.city = address_node.get('addressLocality')
         self.state = address_node.get('addressRegion')
         self.postal_code = address_node.get('postalCode')
-        self.price = clean(raw_price)
-        self.bedrooms = json_elements.get('numberOfRooms')
-        self.info = '{} bds'.format(self.bedrooms)
+        self.price = parse_number(clean(raw_price))
+        bedrooms = json_elements.get('numberOfRooms')
+        self.bedrooms = parse_number(bedrooms)
+        self.info = '{} bds'.format(bedrooms)
         self.address = clean(raw_address)
         self.broker = clean(raw_broker_name)
         self.title = json_elements.get('statusText')
         self.property_url = ZILLOW_URL + json_elements.get('url')
+        match = ZPID_REGEX.search(self.property_url)
+        if match:
+            self.zpid = match.group(1)
 
 
 class ZillowPropertyJson(Property):
+    __slots__ = ()
 
     def __init__(self, json_input):
         super(ZillowPropertyJson, self).__init__()
         self.address = json_input.get('address')
-        self.property_info = json_input.get('hdpData', {}).get('homeInfo')
-        self.city = self.property_info.get('city')
-        self.state = self.property_info.get('state')
-        self.postal_code = self.property_info.get('zipcode')
-        self.days_on_zillow = self.property_info.get('daysOnZillow')
-        self.price = json_input.get('price')
-        self.bedrooms = json_input.get('beds')
-        self.bathrooms = json_input.get('baths')
-        self.area = json_input.get('area')
+        property_info = json_input.get('hdpData', {}).get('homeInfo')
+        self.city = property_info.get('city')
+        self.state = property_info.get('state')
+        self.postal_code = property_info.get('zipcode')
+        self.days_on_zillow = parse_number(property_info.get('daysOnZillow'))
+        self.price = parse_number(json_input.get('price'))
+        bedrooms = json_input.get('beds')
+        bathrooms = json_input.get('baths')
+        area = json_input.get('area')
+        self.bedrooms = parse_number(bedrooms)
+        self.bathrooms = parse_number(bathrooms, float)
+        self.area = parse_number(area)
         self.info = '{} bds, {} ba ,{} sqft'.format(
-            self.bedrooms, self.bathrooms, self.area)
+            bedrooms, bathrooms, area)
         self.broker = json_input.get('brokerName')
         self.property_url = json_input.get('detailUrl')
         self.title = json_input.get('statusText')
+        self.zpid = str(json_input.get('zpid') or '')
@@ -0,0 +1,44 @@
+""" Rate limiting helpers for polite page fetching """
+import random
+import threading
+import time
+
+
+class TokenBucket(object):
+    """ Thread safe token bucket with random jitter added to each acquire
+
+    rate: tokens added per second
+    capacity: maximum burst size
+    jitter: upper bound (seconds) of the random delay added after a token is taken
+    """
+
+    def __init__(self, rate=1.0, capacity=1, jitter=3.0):
+        assert rate > 0, 'rate must be positive'
+        assert capacity >= 1, 'capacity must be at least 1'
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.jitter = float(jitter)
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """ Block until a token is available, returns the time spent waiting """
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    break
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+        if self.jitter > 0:
+            time.sleep(random.random() * self.jitter)
+        return time.monotonic() - start
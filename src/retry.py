@@ -0,0 +1,85 @@
+""" Retry policy for page requests """
+import email.utils
+import random
+import threading
+import time
+
+# statuses worth trying again, everything else that isn't a 200 is fatal
+RETRYABLE_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+# statuses that mean the site is throttling us
+THROTTLE_STATUSES = frozenset([429, 503])
+
+
+class RetryPolicy(object):
+    """ Exponential backoff with full jitter and a retry budget shared by
+    every request of a job
+
+    max_attempts: attempts per request, including the first one
+    base_delay: backoff before the first retry, doubled for every retry
+    max_delay: upper bound of a single backoff (and of Retry-After)
+    budget: retries allowed across all requests using this policy
+    rotate_identity: reset the tor identity when the site throttles us
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0,
+                 budget=50, rotate_identity=False):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.rotate_identity = rotate_identity
+        self.retries = 0
+        self.rotations = 0
+        self.lock = threading.Lock()
+
+    def is_retryable(self, status_code):
+        return status_code is None or status_code in RETRYABLE_STATUSES
+
+    def is_throttled(self, status_code):
+        return status_code in THROTTLE_STATUSES
+
+    def take_retry(self):
+        """ Use up one retry from the budget, False once it is exhausted """
+        with self.lock:
+            if self.retries >= self.budget:
+                return False
+            self.retries += 1
+            return True
+
+    def retry_after(self, response):
+        """ Seconds requested by a Retry-After header, None without one """
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            # neither seconds nor a date, use the normal backoff
+            return None
+        if date is None:
+            return None
+        return max(0.0, date.timestamp() - time.time())
+
+    def delay(self, attempt, response=None):
+        """ Backoff before retry number attempt + 1 """
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def maybe_rotate_identity(self, request, status_code):
+        if not self.rotate_identity or not self.is_throttled(status_code):
+            return False
+        if not hasattr(request, 'reset_identity'):
+            return False
+        if request.reset_identity() is False:
+            return False
+        with self.lock:
+            self.rotations += 1
+        return True
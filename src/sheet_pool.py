@@ -0,0 +1,88 @@
+""" Pool of pre-created spreadsheets that already have the Info tab
+
+Creating a spreadsheet and its disclaimer tab takes several seconds, so a
+background rq job keeps SHEET_POOL_SIZE of them ready in redis and exports
+only rename a pooled sheet and add their data.
+"""
+import uuid
+
+from decouple import config
+
+from src.gsheets import INFO
+from src.sheets_batch import SheetsBatch
+
+# 0 disables the pool
+SHEET_POOL_SIZE = config('SHEET_POOL_SIZE', default=0, cast=int)
+# minimum seconds between two refill jobs
+SHEET_POOL_REFILL_INTERVAL = config(
+    'SHEET_POOL_REFILL_INTERVAL', default=60, cast=int)
+# max sheets created by one refill job
+SHEET_POOL_REFILL_BATCH = config('SHEET_POOL_REFILL_BATCH', default=5, cast=int)
+
+
+class SheetPool(object):
+    SHEETS_KEY = 'zillow:sheet_pool'
+    STATS_KEY = 'zillow:sheet_pool:stats'
+    REFILL_LOCK_KEY = 'zillow:sheet_pool:refill'
+
+    def __init__(self, connection, size=SHEET_POOL_SIZE,
+                 refill_interval=SHEET_POOL_REFILL_INTERVAL,
+                 refill_batch=SHEET_POOL_REFILL_BATCH):
+        self.connection = connection
+        self.size = size
+        self.refill_interval = refill_interval
+        self.refill_batch = refill_batch
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def available(self):
+        return self.connection.llen(self.SHEETS_KEY)
+
+    def take(self, client):
+        """ Open a pooled spreadsheet, None when the pool is empty """
+        sheet_id = self.connection.lpop(self.SHEETS_KEY)
+        if sheet_id is None:
+            self.connection.hincrby(self.STATS_KEY, 'misses', 1)
+            return None
+        self.connection.hincrby(self.STATS_KEY, 'hits', 1)
+        return client.open_by_key(sheet_id.decode('utf8'))
+
+    def create_sheet(self, client):
+        """ New spreadsheet with the formatted Info tab, zip codes left blank """
+        sheet = client.create('zillow_data_pool_{}'.format(uuid.uuid4().hex))
+        batch = SheetsBatch()
+        batch.add_disclaimer(0, INFO.format('').splitlines())
+        sheet.batch_update(batch.body())
+        return sheet
+
+    def refill(self, client):
+        """ Top the pool up, creating at most refill_batch sheets """
+        created = 0
+        while created < self.refill_batch and self.available() < self.size:
+            sheet = self.create_sheet(client)
+            self.connection.rpush(self.SHEETS_KEY, sheet.id)
+            self.connection.hincrby(self.STATS_KEY, 'created', 1)
+            created += 1
+        return created
+
+    def should_refill(self):
+        """ True at most once per refill_interval while the pool is low """
+        if not self.enabled or self.available() >= self.size:
+            return False
+        return bool(self.connection.set(self.REFILL_LOCK_KEY, 1, nx=True,
+                                        ex=self.refill_interval))
+
+    def stats(self):
+        stats = {key.decode('utf8'): int(value) for key, value in
+                 self.connection.hgetall(self.STATS_KEY).items()}
+        return {
+            'size': self.size,
+            'available': self.available(),
+            'refill_interval': self.refill_interval,
+            'refill_batch': self.refill_batch,
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+            'created': stats.get('created', 0),
+        }
@@ -0,0 +1,102 @@
+""" Builds a whole Google Sheets export as spreadsheets.batchUpdate requests
+
+Worksheets, values and formatting of a run are collected as plain request
+dicts and sent in a single batch_update call instead of one api round trip
+per worksheet, range and format.
+"""
+
+
+def color(red, green, blue):
+    return {'red': red, 'green': green, 'blue': blue}
+
+
+HEADER_FORMAT = {
+    'backgroundColor': color(0.7, 0.77, 0.87),
+    'textFormat': {'bold': True, 'foregroundColor': color(0, 0, .54)},
+    'horizontalAlignment': 'LEFT',
+}
+FIELDS_FORMAT = dict(HEADER_FORMAT, horizontalAlignment='CENTER')
+FORMAT_FIELDS = 'userEnteredFormat(backgroundColor,textFormat,horizontalAlignment)'
+
+
+def cell_data(value):
+    """ CellData for a raw python value """
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+class SheetsBatch(object):
+    """ Collects the requests of one spreadsheet batchUpdate """
+
+    def __init__(self):
+        self.requests = []
+        self.next_sheet_id = 1
+
+    def __len__(self):
+        return len(self.requests)
+
+    def body(self):
+        return {'requests': self.requests}
+
+    def rename_spreadsheet(self, title):
+        self.requests.append({'updateSpreadsheetProperties': {
+            'properties': {'title': title},
+            'fields': 'title'}})
+
+    def rename_sheet(self, sheet_id, title):
+        self.requests.append({'updateSheetProperties': {
+            'properties': {'sheetId': sheet_id, 'title': title},
+            'fields': 'title'}})
+
+    def add_sheet(self, title, rows, cols):
+        """ Adds a worksheet, returns the sheet id later requests can use """
+        sheet_id = self.next_sheet_id
+        self.next_sheet_id += 1
+        self.requests.append({'addSheet': {'properties': {
+            'sheetId': sheet_id,
+            'title': title,
+            'gridProperties': {'rowCount': rows, 'columnCount': cols}}}})
+        return sheet_id
+
+    def update_values(self, sheet_id, rows, start_row=0, start_col=0):
+        """ rows: lists of raw values, written starting at the given cell """
+        self.requests.append({'updateCells': {
+            'start': {'sheetId': sheet_id,
+                      'rowIndex': start_row,
+                      'columnIndex': start_col},
+            'rows': [{'values': [cell_data(value) for value in row]}
+                     for row in rows],
+            'fields': 'userEnteredValue'}})
+
+    def format_rows(self, sheet_id, row_indexes, cols, cell_format):
+        for row in row_indexes:
+            self.requests.append({'repeatCell': {
+                'range': {'sheetId': sheet_id,
+                          'startRowIndex': row,
+                          'endRowIndex': row + 1,
+                          'startColumnIndex': 0,
+                          'endColumnIndex': cols},
+                'cell': {'userEnteredFormat': cell_format},
+                'fields': FORMAT_FIELDS}})
+
+    def add_disclaimer(self, sheet_id, lines):
+        """ Fill the first worksheet (created with the spreadsheet) with lines """
+        self.rename_sheet(sheet_id, 'Info')
+        self.update_values(sheet_id, [[line] for line in lines])
+        # title, support and disclaimer lines of INFO
+        self.format_rows(sheet_id, [0, 2, 3, 8], 5, HEADER_FORMAT)
+
+    def add_data_sheet(self, title, header, fieldnames, rows):
+        """ Worksheet with a header line, fieldnames and one row per listing """
+        rows = list(rows)
+        cols = len(fieldnames)
+        sheet_id = self.add_sheet(title, len(rows) + 2, cols)
+        self.update_values(sheet_id, [[header]] + [list(fieldnames)] + rows)
+        self.format_rows(sheet_id, [0], cols, HEADER_FORMAT)
+        self.format_rows(sheet_id, [1], cols, FIELDS_FORMAT)
+        return sheet_id
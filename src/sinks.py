@@ -0,0 +1,186 @@
+""" Local output formats for ZillowScraperCsv
+
+Every writer takes properties in batches and writes them as rows of the
+given fieldnames. Csv, gzip csv and ndjson files can be appended to across
+runs, parquet appends by adding a part file to a dataset directory.
+"""
+import datetime
+import gzip
+import json
+import os
+
+from src.metrics import metrics
+from src.properties import PropertyBatch
+
+LAYOUTS = ('single', 'per-zip', 'partitioned')
+
+
+def import_pyarrow():
+    """ pyarrow is slow to import, it is only loaded for parquet output.
+    None if it isn't installed """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+class RowWriter(object):
+    """ Base writer, buffers up to BATCH_SIZE rows before writing them """
+    EXTENSION = ''
+    # 0 writes every batch straight away
+    BATCH_SIZE = 0
+
+    def __init__(self, path, fieldnames, append=False):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.append = append
+        self.pending = []
+        self.rows_written = 0
+
+    def write(self, properties):
+        self.pending.extend(properties)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with metrics.timer('sink_flush'):
+            self.write_batch(PropertyBatch.from_properties(self.pending))
+        self.rows_written += len(self.pending)
+        self.pending = []
+
+    def write_batch(self, batch):
+        """ Virtual method, implement in base class """
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class CsvWriter(RowWriter):
+    EXTENSION = 'csv'
+
+    def __init__(self, path, fieldnames, append=False):
+        super(CsvWriter, self).__init__(path, fieldnames, append)
+        write_header = not (append and os.path.exists(path))
+        self.outfile = self.open(path, 'ab' if append else 'wb')
+        import unicodecsv
+        self.writer = unicodecsv.writer(self.outfile)
+        if write_header:
+            self.writer.writerow(fieldnames)
+
+    def open(self, path, mode):
+        return open(path, mode)
+
+    def write_batch(self, batch):
+        self.writer.writerows(batch.rows(self.fieldnames))
+        self.outfile.flush()
+
+    def close(self):
+        super(CsvWriter, self).close()
+        self.outfile.close()
+
+
+class GzipCsvWriter(CsvWriter):
+    EXTENSION = 'csv.gz'
+    # gzip compresses better on bigger writes
+    BATCH_SIZE = 1000
+
+    def open(self, path, mode):
+        # appending adds a gzip member, which readers treat as one stream
+        return gzip.open(path, mode)
+
+
+class NdjsonWriter(RowWriter):
+    EXTENSION = 'ndjson'
+
+    def __init__(self, path, fieldnames, append=False):
+        super(NdjsonWriter, self).__init__(path, fieldnames, append)
+        self.outfile = open(path, 'a' if append else 'w')
+
+    def write_batch(self, batch):
+        lines = []
+        for row in batch.rows(self.fieldnames, missing=None):
+            lines.append(json.dumps(dict(zip(self.fieldnames, row))))
+        lines.append('')
+        self.outfile.write('\n'.join(lines))
+        self.outfile.flush()
+
+    def close(self):
+        super(NdjsonWriter, self).close()
+        self.outfile.close()
+
+
+class ParquetWriter(RowWriter):
+    EXTENSION = 'parquet'
+    BATCH_SIZE = 10000
+
+    def __init__(self, path, fieldnames, append=False):
+        self.pyarrow = import_pyarrow()
+        if self.pyarrow is None:
+            raise Exception('pyarrow is required for parquet output')
+        super(ParquetWriter, self).__init__(path, fieldnames, append)
+        if append:
+            # path is a dataset directory, every run adds a part
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, 'part-{}.parquet'.format(
+                datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')))
+        self.schema = self.pyarrow.schema(
+            [(field, self.arrow_type(field)) for field in fieldnames])
+        self.writer = self.pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def arrow_type(self, field):
+        if field in PropertyBatch.INT_FIELDS:
+            return self.pyarrow.int64()
+        if field in PropertyBatch.FLOAT_FIELDS:
+            return self.pyarrow.float64()
+        if field == 'is_forsale':
+            return self.pyarrow.bool_()
+        return self.pyarrow.string()
+
+    def write_batch(self, batch):
+        arrays = [self.pyarrow.array(batch.column(field),
+                                     type=self.schema.field(field).type)
+                  for field in self.fieldnames]
+        self.writer.write_table(
+            self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        super(ParquetWriter, self).close()
+        self.writer.close()
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'csv.gz': GzipCsvWriter,
+    'ndjson': NdjsonWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def output_path(outdir, output_format, layout, label, append=False):
+    """ File (or parquet dataset) for label: the zip code, or the last zip
+    code of the run for the single layout """
+    extension = WRITERS[output_format].EXTENSION
+    timestamp = datetime.datetime.now().strftime('%m_%d_%Y__%H_%M_%S')
+    if layout == 'partitioned':
+        # hive style key of the searched zip code, postal_code is a column
+        # of every row and can differ from it
+        directory = os.path.join(outdir, 'zillow_data',
+                                 'zip_code={}'.format(label))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, 'part-{}.{}'.format(
+            datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'), extension))
+    if append:
+        # a stable name so later runs add to the same file
+        name = 'zillow_data_{}.{}'.format(label, extension)
+    else:
+        name = 'zillow_data_{}_{}.{}'.format(timestamp, label, extension)
+    return os.path.join(outdir, name)
+
+
+def open_writer(output_format, path, fieldnames, append=False):
+    return WRITERS[output_format](path, fieldnames, append)
@@ -0,0 +1,165 @@
+""" Snapshots of previously seen listings for incremental re-scrapes """
+import os
+import sqlite3
+import time
+
+from decouple import config
+
+from src.properties import Property
+
+SNAPSHOT_PATH = config(
+    'SNAPSHOT_PATH', default=os.path.expanduser('~/.zillow_snapshots.sqlite'))
+# seconds after which a zip code is paginated fully again to find removals
+FULL_SCAN_INTERVAL = config('FULL_SCAN_INTERVAL', default=604800, cast=int)
+
+NEW = 'new'
+PRICE_CHANGED = 'price_changed'
+STATUS_CHANGED = 'status_changed'
+REMOVED = 'removed'
+
+
+class SnapshotStore(object):
+    """ Last known price, status and days on zillow of every listing """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS listings ('
+            'key TEXT PRIMARY KEY, zip_code TEXT, address TEXT, '
+            'property_url TEXT, price INTEGER, status TEXT, '
+            'days_on_zillow INTEGER, seen_at REAL)')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS listings_zip ON listings (zip_code)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS full_scans ('
+            'zip_code TEXT PRIMARY KEY, scanned_at REAL)')
+        self.db.commit()
+
+    COLUMNS = 'key, zip_code, address, property_url, price, status, days_on_zillow'
+
+    def to_property(self, row):
+        key, zip_code, address, property_url, price, status, days = row
+        prop = Property()
+        prop.postal_code = zip_code
+        prop.address = address
+        prop.property_url = property_url
+        prop.price = price
+        prop.title = status
+        prop.days_on_zillow = days
+        return prop
+
+    def load(self, zip_code):
+        """ listing key -> Property with the fields of the last sighting """
+        rows = self.db.execute(
+            'SELECT {} FROM listings WHERE zip_code = ?'.format(self.COLUMNS),
+            (zip_code,)).fetchall()
+        return {row[0]: self.to_property(row) for row in rows}
+
+    def get(self, key):
+        row = self.db.execute(
+            'SELECT {} FROM listings WHERE key = ?'.format(self.COLUMNS),
+            (key,)).fetchone()
+        return self.to_property(row) if row else None
+
+    def last_full_scan(self, zip_code):
+        """ Time of the last run that paginated zip_code fully, or None """
+        row = self.db.execute(
+            'SELECT scanned_at FROM full_scans WHERE zip_code = ?',
+            (zip_code,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, zip_code, properties, removed_keys=(), complete=False):
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(prop.listing_key, zip_code, prop.address, prop.property_url,
+              prop.price, prop.title, prop.days_on_zillow, now)
+             for prop in properties])
+        self.db.executemany('DELETE FROM listings WHERE key = ?',
+                            [(key,) for key in removed_keys])
+        if complete:
+            self.db.execute(
+                'INSERT OR REPLACE INTO full_scans VALUES (?, ?)',
+                (zip_code, now))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class SnapshotDiff(object):
+    """ Compares a run against the snapshot and keeps only what changed
+
+    Every listing handed back has its change field set to new,
+    price_changed or status_changed. Listings of the snapshot that were not
+    seen anywhere in the run are reported as removed once a zip code has
+    been fully paginated. Paging stops early at the first unchanged page,
+    except when the last full pagination is older than full_scan_interval.
+    """
+
+    def __init__(self, store, full_scan_interval=FULL_SCAN_INTERVAL):
+        self.store = store
+        self.full_scan_interval = full_scan_interval
+        self.full_scans = set()
+        self.previous = {}
+        self.current = {}
+        self.seen_keys = set()
+        self.counts = {}
+
+    def start(self, zip_code):
+        self.previous[zip_code] = self.store.load(zip_code)
+        self.current[zip_code] = []
+        self.counts[zip_code] = {NEW: 0, PRICE_CHANGED: 0, STATUS_CHANGED: 0,
+                                 REMOVED: 0, 'unchanged': 0}
+        last_scan = self.store.last_full_scan(zip_code)
+        if (last_scan is None or
+                time.time() - last_scan >= self.full_scan_interval):
+            self.full_scans.add(zip_code)
+
+    def needs_full_scan(self, zip_code):
+        """ True if every page of zip_code should be fetched this run """
+        return zip_code in self.full_scans
+
+    def count(self, zip_code, change):
+        self.counts[zip_code][change] += 1
+
+    def filter(self, zip_code, properties):
+        """ Returns (changed listings, True if every listing was unchanged) """
+        previous = self.previous[zip_code]
+        changed = []
+        for prop in properties:
+            key = prop.listing_key
+            self.seen_keys.add(key)
+            self.current[zip_code].append(prop)
+            known = previous.get(key) or self.find_elsewhere(key)
+            if known is None:
+                prop.change = NEW
+            elif known.price != prop.price:
+                prop.change = PRICE_CHANGED
+            elif known.title != prop.title:
+                prop.change = STATUS_CHANGED
+            else:
+                self.count(zip_code, 'unchanged')
+                continue
+            self.count(zip_code, prop.change)
+            changed.append(prop)
+        return changed, bool(properties) and not changed
+
+    def find_elsewhere(self, key):
+        # the listing may have been filed under a neighbouring zip code
+        return self.store.get(key)
+
+    def finish(self, zip_code, complete=True):
+        """ Save the snapshot, returns the removed listings when complete """
+        removed = []
+        if complete:
+            for key, prop in self.previous[zip_code].items():
+                if key not in self.seen_keys:
+                    prop.change = REMOVED
+                    removed.append(prop)
+                    self.count(zip_code, REMOVED)
+        self.store.save(zip_code, self.current.pop(zip_code),
+                        [prop.listing_key for prop in removed],
+                        complete=complete)
+        self.full_scans.discard(zip_code)
+        return removed
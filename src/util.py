@@ -3,33 +3,76 @@ import getpass
 import os
 import re
 import requests
+import time
 
 from decouple import config
-from torrequest import TorRequest
+
+from src.fetcher import HttpFetcher
+from src.metrics import metrics, timed
+from src.retry import RetryPolicy
 
 TOR_CONF = '/tmp/.tor.conf'
 
 EMAIL_REGEX = re.compile('\S+@\S+')
 
-
-def get_response(request, url, headers, response_path=None, verbose=False):
-    for i in range(5):
-        response = request.get(url, headers=headers)
-        if verbose:
-            print('URL: {}'.format(url))
-            print('Response:\n{}'.format(response.text))
-        if response_path:
-            save_to_file(response_path, response.text)
-        if 'Please verify you\'re a human to continue.' in response.text:
-            raise Exception(
-                '!!!REcaptcha robot blocking us from site!!!'.format(url))
-        if response.status_code != 200:
-            continue
-        return response
-    return None
+CAPTCHA_TEXT = 'Please verify you\'re a human to continue.'
+
+# only print the start of response bodies when verbose
+MAX_VERBOSE_BODY = 500
+
+
+class CaptchaError(Exception):
+    """ Zillow answered with its captcha page instead of results """
+
+
+@timed('get_response')
+def get_response(request, url, headers, response_path=None, verbose=False,
+                 retry_policy=None):
+    policy = retry_policy or RetryPolicy()
+    response = None
+    for attempt in range(policy.max_attempts):
+        metrics.add('http_requests')
+        try:
+            response = request.get(url, headers=headers)
+            status_code = response.status_code
+        except requests.RequestException as e:
+            response = None
+            status_code = None
+            print('Request for {} failed: {}'.format(url, e))
+        if verbose and response is not None:
+            print('URL: {} ({})'.format(url, status_code))
+            print('Response:\n{}'.format(response.text[:MAX_VERBOSE_BODY]))
+        if response is not None and CAPTCHA_TEXT in response.text:
+            raise CaptchaError(
+                '!!!REcaptcha robot blocking us from site!!! {}'.format(url))
+        if status_code == 200:
+            break
+        if not policy.is_retryable(status_code):
+            print('Giving up on {}, status {}'.format(url, status_code))
+            break
+        if attempt + 1 == policy.max_attempts:
+            break
+        if not policy.take_retry():
+            print('Retry budget exhausted, giving up on {}'.format(url))
+            break
+        if policy.maybe_rotate_identity(request, status_code):
+            print('Throttled ({}), reset tor identity'.format(status_code))
+        delay = policy.delay(attempt, response)
+        metrics.add('http_retries')
+        metrics.observe('retry_sleep', delay)
+        time.sleep(delay)
+
+    if response_path and response is not None:
+        save_to_file(response_path, response.text)
+    if status_code != 200:
+        return None
+    return response
 
 
 def get_tor_client(ask_if_needed=False):
+    # stem and torrequest are only needed when tor is used
+    from torrequest import TorRequest
+
     tpwd = config('TOR_PASSWORD', '')
     if not tpwd and os.path.isfile(TOR_CONF):
         with open(TOR_CONF) as infile:
@@ -46,13 +89,44 @@ def get_tor_client(ask_if_needed=False):
         print('Session established!')
     except OSError:
         print('Tor not available, using regular requests...')
-        tr = requests
-    return tr
+        return HttpFetcher(headers=get_headers())
+    return HttpFetcher(proxies=tr.session.proxies, headers=get_headers(), tor=tr)
+
+
+HEADERS = {'user-agent': 'Chrome/78.0.3904.108 Safari/537.36'}
 
 
 def get_headers():
-    headers = {'user-agent': 'Chrome/78.0.3904.108 Safari/537.36'}
-    return headers
+    return dict(HEADERS)
+
+
+def print_connection_stats(request):
+    """ Print connection reuse of an HttpFetcher """
+    if not hasattr(request, 'connection_stats'):
+        return
+    total = request.connection_stats()['total']
+    print('{} requests over {} connections ({} reused)'.format(
+        total['requests'], total['connections'], total['reused']))
+
+
+def print_cache_stats(request):
+    """ Print the hit rate of a CachedFetcher """
+    if not hasattr(request, 'cache_stats'):
+        return
+    stats = request.cache_stats()
+    print('Response cache: {} hits, {} revalidated, {} misses ({:.0%} hit rate)'.format(
+        stats['hits'], stats['revalidated'], stats['misses'], stats['hit_rate']))
+
+
+def print_circuit_stats(request):
+    """ Print success rate and latency of every circuit of a ClientPool """
+    if not hasattr(request, 'circuit_stats'):
+        return
+    for name, stats in sorted(request.circuit_stats().items()):
+        print('{}: {requests} requests, {success_rate:.0%} ok, {captchas} '
+              'captchas, {average_latency:.2f}s average{}'.format(
+                  name, ' (quarantined)' if stats['quarantined'] else '',
+                  **stats))
 
 
 def clean(text):
@@ -62,7 +136,7 @@ def clean(text):
 
 
 def save_to_file(path, data):
-    with open(path, 'w') as fp:
+    with open(path, 'wb') as fp:
         fp.write(data.encode('utf8'))
 
 
@@ -1,43 +1,97 @@
-import datetime
-import gspread
-import gspread_formatting as gsf
 import json
+import multiprocessing
 import os
+import queue
 import random
 import re
-import time
-import unicodecsv
+import threading
 
-from decouple import config
-from lxml import html
-from oauth2client.service_account import ServiceAccountCredentials
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
+from lxml import etree, html
 from tqdm import tqdm
+from urllib.parse import urlsplit
 
+from src.cache import (RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL,
+                       CachedFetcher, ResponseCache)
+from src.client_pool import create_client_pool
+from src.metrics import metrics, timed
+from src.properties import PropertyIndex
 from src.properties import ZillowPropertyHtml, ZillowPropertyJson
+from src.rate_limit import TokenBucket
+from src.retry import RetryPolicy
+from src.sinks import LAYOUTS, WRITERS, open_writer, output_path
+from src.snapshots import SNAPSHOT_PATH, SnapshotDiff, SnapshotStore
 from src.urls import ZILLOW_URL
-from src.util import get_tor_client, read_files, clean, get_response, get_headers
-from src.util import EMAIL_REGEX
-
-CREDENTIALS = config(
-    'GOOGLE_CREDENTIALS',
-    default=None,
-    cast=lambda x: json.loads(x))
-
-
-def scrape_zillow_zipcode(zip_code, email):
-    match = re.match(EMAIL_REGEX, email)
-    if not match:
-        return False
-    zsearch = ZillowScraperGsheets([zip_code], email)
-    zsearch.scrape()
-    return True
-
-
+from src.util import get_headers, get_response, get_tor_client
+from src.util import print_cache_stats, print_circuit_stats
+from src.util import print_connection_stats
+
+# optional faster decoders for the search store json
+try:
+    from orjson import loads as fast_json_loads
+except ImportError:
+    try:
+        from ujson import loads as fast_json_loads
+    except ImportError:
+        fast_json_loads = None
+
+# sheets export moved to src.gsheets, which is only imported when used
+GSHEETS_NAMES = ('CREDENTIALS', 'GSHEETS_SCOPE', 'INFO', 'ZillowScraperGsheets',
+                 'create_gsheets_client', 'scrape_zillow_zipcode')
+
+
+def __getattr__(name):
+    if name in GSHEETS_NAMES:
+        from src import gsheets
+        if name == 'CREDENTIALS':
+            return gsheets.google_credentials()
+        return getattr(gsheets, name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+# xpaths are compiled once and reused for every page
+TOTAL_TEXT_XPATH = etree.XPath('//div[@class="total-text"]/text()')
+PAGINATION_XPATH = etree.XPath(
+    '//nav[@role="navigation"][@aria-label="Pagination"]/ul/li//a/@href')
+LIST_CARD_XPATH = etree.XPath(
+    '//article[@class="list-card list-card-short list-card_not-saved"]')
+LD_JSON_XPATH = etree.XPath('//li/script[@type="application/ld+json"]//text()')
+SEARCH_STORE_XPATH = etree.XPath(
+    '//script[@data-zrr-shared-data-key="mobileSearchPageStore"]//text()')
+CAT1_REGEX = re.compile(r'"cat1"\s*:')
+LIST_RESULTS_REGEX = re.compile(r'"listResults"\s*:\s*')
+JSON_DECODER = json.JSONDecoder()
+
+
+@timed('lxml_parse')
+def build_tree(text):
+    return html.fromstring(text)
+
+
+class ZillowResultsPage(object):
+    """ Raw html of a search results page that is parsed at most once """
+    __slots__ = ('text', '_tree')
+
+    def __init__(self, text):
+        self.text = text
+        self._tree = None
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = build_tree(self.text)
+        return self._tree
+
+    @property
+    def is_parsed(self):
+        return self._tree is not None
+
+
+@timed('xml_results')
 def maybe_get_xml_results(parser, verbose=False):
-    xml_results = parser.xpath(
-        '//article[@class="list-card list-card-short list-card_not-saved"]')
-    string_results = parser.xpath(
-        '//li/script[@type="application/ld+json"]//text()')
+    xml_results = LIST_CARD_XPATH(parser)
+    string_results = LD_JSON_XPATH(parser)
     json_results = []
     for result in string_results:
         json_result = json.loads(result)
@@ -51,57 +105,226 @@ def maybe_get_xml_results(parser, verbose=False):
     return properties
 
 
+def strip_comment(text):
+    """ The store json is wrapped in <!-- --> inside its script tag """
+    start = text.find('<!--')
+    if start != -1:
+        text = text[start + 4:]
+    end = text.rfind('-->')
+    if end != -1:
+        text = text[:end]
+    return text
+
+
+def decode_list_results(text):
+    """ cat1.searchResults.listResults of the search store json
+
+    A fast decoder, when installed, reads the whole store. Otherwise only the
+    listResults array is decoded, starting right at its key.
+    """
+    text = strip_comment(text)
+    if fast_json_loads is None:
+        cat1 = CAT1_REGEX.search(text)
+        match = cat1 and LIST_RESULTS_REGEX.search(text, cat1.end())
+        if match:
+            return JSON_DECODER.raw_decode(text, match.end())[0]
+        json_data = json.loads(text)
+    else:
+        json_data = fast_json_loads(text)
+    return json_data.get('cat1').get('searchResults').get('listResults', [])
+
+
+@timed('json_results')
 def maybe_get_json_results(parser, verbose=False):
-    raw_json = parser.xpath(
-        '//script[@data-zrr-shared-data-key="mobileSearchPageStore"]//text()')
-    cleaned_data = clean(raw_json).replace('<!--', "").replace("-->", "")
-    json_data = json.loads(cleaned_data)
-    search_results = json_data.get('cat1').get(
-        'searchResults').get('listResults', [])
+    raw_json = SEARCH_STORE_XPATH(parser)
+    if not raw_json:
+        return []
+    search_results = decode_list_results(''.join(raw_json))
     properties = []
     for result in search_results:
         properties.append(ZillowPropertyJson(result))
     return properties
 
 
-class ZillowHtmlDownloader(object):
-    """ Class that downloads zillow zip code searches for scraping """
+@timed('parse_properties')
+def parse_properties(page, verbose=False):
+    """ page: raw html or a ZillowResultsPage whose tree may already be built """
+    if not isinstance(page, ZillowResultsPage):
+        page = ZillowResultsPage(page)
+    parser = page.tree
+    # try json first as it generally has more consistent info
+    properties = maybe_get_json_results(parser, verbose)
+    # try parsing the xml directly afterwards
+    properties.extend(maybe_get_xml_results(parser, verbose))
+    properties_list = []
+    parsed_keys = set()
+    for prop in properties:
+        key = prop.listing_key
+        if key in parsed_keys:
+            continue
+        if verbose:
+            print('Found {}'.format(prop.address))
+        parsed_keys.add(key)
+        properties_list.append(prop)
+    metrics.add('properties_parsed', len(properties_list))
+    return properties_list
+
 
-    def __init__(self, tor, zip_code, verbose=False):
+class ZillowHtmlDownloader(object):
+    """ Class that downloads zillow zip code searches for scraping
+
+    concurrency: number of result pages fetched at the same time
+    rate: page requests per second allowed by the rate limiter
+    jitter: max random delay (seconds) added to every page request
+    retry_policy: RetryPolicy shared by every request of the job
+    newest_first: sort results by days on zillow and fetch pages in order
+    limiter: TokenBucket shared by every downloader of the same host,
+        rate and jitter only apply when the downloader creates its own
+
+    The defaults reproduce the original pacing of one page at a time with a
+    1-4 second pause between pages.
+    """
+
+    def __init__(self, tor, zip_code, verbose=False,
+                 concurrency=1, rate=1.0, jitter=3.0, retry_policy=None,
+                 newest_first=False, limiter=None):
         self.zip_code = zip_code
+        self.newest_first = newest_first
+        self.stopped = threading.Event()
+        self.retry_policy = retry_policy or RetryPolicy()
         self.tor = tor
         self.verbose = verbose
+        self.concurrency = max(1, int(concurrency))
+        if limiter is None:
+            limiter = TokenBucket(rate=rate, capacity=self.concurrency,
+                                  jitter=jitter)
+        self.limiter = limiter
+        self.failed_pages = {}
+        self.page_urls = []
 
     def create_starting_url(self):
         # Creating Zillow URL based on the filter.
         url = os.path.join(ZILLOW_URL, 'homes/for_sale/', self.zip_code)
-        url += '_rb/?fromHomePage=true&shouldFireSellPageImplicitClaimGA=false&fromHomePageTab=buy'
+        url += '_rb/'
+        if self.newest_first:
+            url += 'days_sort/'
+        url += '?fromHomePage=true&shouldFireSellPageImplicitClaimGA=false&fromHomePageTab=buy'
         return url
 
+    def stop(self):
+        """ Don't fetch any more pages, pages in flight are still returned """
+        self.stopped.set()
+
+    @property
+    def is_complete(self):
+        """ True if every result page was fetched """
+        return not self.stopped.is_set() and not self.failed_pages
+
     def query_zillow(self):
+        """ Download every result page, returns the pages in page order """
+        pages = dict(self.iter_pages())
+        if 1 not in pages:
+            return None
+        return [pages[page].text for page in sorted(pages)]
+
+    def iter_pages(self):
+        """ Yield (page number, ZillowResultsPage) for every result page as
+        soon as it arrives so callers can process and drop each page right
+        away. Pages after the first come back in completion order, the first
+        page is handed over with the tree already built for pagination.
+        """
+        first_page, page_urls = self.fetch_first_page()
+        if first_page is None:
+            return
+        yield 1, first_page
+        first_page = None
+
+        for page, result in self.iter_page_urls(page_urls):
+            yield page, result
+
+    def fetch_first_page(self):
+        """ Returns (ZillowResultsPage, (page, url) pairs of the other pages),
+        or (None, []) when the first page can't be fetched """
+        self.failed_pages = {}
         url = self.create_starting_url()
-        response = get_response(
-            self.tor,
-            url,
-            get_headers(),
-            response_path=None,
-            verbose=self.verbose)
+        response = self.request(url)
         if not response:
             print("Failed to fetch the page.")
-            return None
+            self.failed_pages[1] = url
+            return None, []
+        first_page = ZillowResultsPage(response.text)
         try:
-            responses = self.parse_zillow_response(response)
+            page_urls = self.parse_zillow_response(first_page)
         except BaseException:
             print(url)
             raise
-        return responses
+        self.page_urls = page_urls
+        return first_page, page_urls
+
+    def iter_page_urls(self, page_urls):
+        """ Yield (page number, ZillowResultsPage) for the given pages """
+        for page, text in self.fetch_pages(page_urls):
+            yield page, ZillowResultsPage(text)
+
+        for page in sorted(self.failed_pages):
+            print('Failed to fetch page {} for {}: {}'.format(
+                page, self.zip_code, self.failed_pages[page]))
+
+    def request(self, url):
+        """ get_response for url, fresh cached pages are served without
+        waiting for the rate limiter, everything going to the network
+        (revalidations included) waits for it """
+        if isinstance(self.tor, CachedFetcher):
+            response = self.tor.peek(url)
+            if response is not None:
+                return response
+        metrics.observe('rate_limit_wait', self.limiter.acquire())
+        return get_response(
+            self.tor, url, get_headers(), verbose=self.verbose,
+            retry_policy=self.retry_policy)
+
+    def fetch_page(self, page, url):
+        try:
+            response = self.request(url)
+        except Exception as e:
+            self.failed_pages[page] = '{} ({})'.format(url, e)
+            return None
+        if not response:
+            self.failed_pages[page] = url
+            return None
+        return response.text
 
-    def parse_zillow_response(self, response):
-        responses = [response.text]
-        parser = html.fromstring(response.text)
+    def fetch_pages(self, page_urls):
+        """ Fetch (page, url) pairs in the thread pool, yielding (page, html)
+        as each one completes. Only a small window of pages is in flight so
+        finished pages never pile up in memory.
+        """
+        window = self.concurrency * 2
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor, \
+                tqdm(total=len(page_urls)) as progress:
+            pending = {}
+            queued = list(reversed(page_urls))
+            while queued or pending:
+                if self.stopped.is_set():
+                    queued = []
+                while queued and len(pending) < window:
+                    page, url = queued.pop()
+                    pending[executor.submit(self.fetch_page, page, url)] = page
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = pending.pop(future)
+                    progress.update(1)
+                    text = future.result()
+                    if text is not None:
+                        yield page, text
+
+    @timed('parse_zillow_response')
+    def parse_zillow_response(self, first_page):
+        """ Read the first ZillowResultsPage, returns (page, url) pairs for
+        the others """
+        parser = first_page.tree
         print('Reading root page results')
-        result_count_str = parser.xpath(
-            "//div[@class=\"total-text\"]/text()")
+        result_count_str = TOTAL_TEXT_XPATH(parser)
         total_homes_results = 0
         for results in result_count_str:
             total_homes_results += int(results.strip())
@@ -115,38 +338,59 @@ class ZillowHtmlDownloader(object):
         # don't add 1 b/c we've already queried the first page
         pages_to_query = int(total_homes_results / PROPERTIES_PER_PAGE)
         if pages_to_query <= 0:
-            return responses
+            return []
 
         if self.verbose:
             with open('/tmp/output.txt', 'w') as f:
-                f.write(response.text)
+                f.write(first_page.text)
 
-        next_page = parser.xpath(
-            '//nav[@role="navigation"][@aria-label="Pagination"]/ul/li//a/@href')[0]
+        next_page = PAGINATION_XPATH(parser)[0]
         next_page_prefix = ZILLOW_URL + next_page
 
-        # create some randomness in page browsing
         pages = [page for page in range(2, 2 + pages_to_query)]
-        random.shuffle(pages)
-
-        for page in tqdm(pages):
-            url = os.path.join(next_page_prefix, '{}_p'.format(page))
-            response = get_response(
-                self.tor, url, get_headers(), verbose=self.verbose)
-            if not response:
-                print("Failed to fetch the next page: {}".format(url))
-                continue
-            responses.append(response.text)
-            time.sleep(1.0 + random.random() * 3.0)
-        return responses
+        if not self.newest_first:
+            # create some randomness in page browsing
+            random.shuffle(pages)
+        return [(page, os.path.join(next_page_prefix, '{}_p'.format(page)))
+                for page in pages]
 
 
 class ZillowScraper(object):
     """ Class for scraping Zillow search html """
 
-    def __init__(self, zip_codes, verbose=False):
+    def __init__(self, zip_codes, verbose=False,
+                 concurrency=1, rate=1.0, jitter=3.0,
+                 zip_workers=1, parse_workers=None,
+                 retry_budget=50, rotate_identity=False,
+                 cache_ttl=RESPONSE_CACHE_TTL, cache_path=RESPONSE_CACHE_PATH,
+                 since_last=False, snapshot_path=SNAPSHOT_PATH,
+                 checkpoints=None, resume=False):
         self.zip_code = ''
         self.zip_codes = zip_codes
+        self.concurrency = concurrency
+        self.rate = rate
+        self.jitter = jitter
+        self.zip_workers = max(1, int(zip_workers))
+        self.parse_workers = parse_workers
+        self.retry_budget = retry_budget
+        self.rotate_identity = rotate_identity
+        self.retry_policy = None
+        self.cache_ttl = cache_ttl
+        self.cache_path = cache_path
+        self.since_last = since_last
+        self.snapshot_path = snapshot_path
+        self.snapshot_diff = None
+        # CheckpointStore or RedisCheckpointStore, resume replays it
+        self.checkpoints = checkpoints
+        self.resume = resume
+        self.checkpoint_outputs = {}
+        self.finished_checkpoints = []
+        self.downloaders = {}
+        # host -> TokenBucket
+        self.limiters = {}
+        self.failed_zip_codes = {}
+        self.pending_properties = {}
+        self.seen_properties = PropertyIndex()
         self.addresses = []
         self.fieldnames = sorted(['title',
                                   'address',
@@ -158,26 +402,14 @@ class ZillowScraper(object):
                                   'info',
                                   'broker',
                                   'property_url'])
+        if self.since_last:
+            self.fieldnames.append('change')
         self.verbose = verbose
         if self.verbose:
             print('Verbose printing enabled!')
 
     def parse_properties(self, raw_html):
-        parser = html.fromstring(raw_html)
-        # try json first as it generally has more consistent info
-        properties = maybe_get_json_results(parser, self.verbose)
-        # try parsing the xml directly afterwards
-        properties.extend(maybe_get_xml_results(parser, self.verbose))
-        properties_list = []
-        parsed_addresses = []
-        for prop in properties:
-            if prop.address in parsed_addresses:
-                continue
-            if self.verbose:
-                print('Found {}'.format(prop.address))
-            parsed_addresses.append(prop.address)
-            properties_list.append(prop)
-        return properties_list
+        return parse_properties(raw_html, self.verbose)
 
     def write_csv(self):
         """ Virtual method, implement in base class """
@@ -189,187 +421,433 @@ class ZillowScraper(object):
         """
         raise NotImplementedError
 
+    def add_properties(self, zip_code, properties):
+        """ Called with the properties of every page as soon as it is parsed.
+        Sinks that can write incrementally override this, by default the
+        properties are held until the zip code is finished.
+        """
+        self.pending_properties.setdefault(zip_code, []).extend(properties)
+
+    def start_zip_code(self, zip_code, downloader):
+        self.downloaders[zip_code] = downloader
+        if self.snapshot_diff is not None:
+            self.snapshot_diff.start(zip_code)
+
+    def add_page(self, zip_code, page, properties):
+        """ add_unique_properties for a freshly parsed page, which is
+        checkpointed first """
+        if self.checkpoints is not None:
+            page_urls = None
+            if page == 1:
+                page_urls = self.downloaders[zip_code].page_urls
+            self.checkpoints.save_page(zip_code, page, properties,
+                                       page_urls=page_urls)
+        self.add_unique_properties(zip_code, properties)
+
+    def add_unique_properties(self, zip_code, properties):
+        """ Drop listings already seen earlier in the run, in any zip code.
+        With since_last only new or changed listings are kept, and paging
+        stops at the first page without any unless a full scan is due. """
+        if self.snapshot_diff is not None:
+            properties, unchanged = self.snapshot_diff.filter(
+                zip_code, properties)
+            if (unchanged and
+                    not self.snapshot_diff.needs_full_scan(zip_code) and
+                    not self.downloaders[zip_code].stopped.is_set()):
+                print('Only known listings left for {}, stop paging'.format(
+                    zip_code))
+                self.downloaders[zip_code].stop()
+        self.output_properties(
+            zip_code, self.seen_properties.filter(properties, zip_code))
+
+    def output_properties(self, zip_code, properties):
+        """ add_properties, keeping what went to the sink for the checkpoint
+        of the zip code """
+        if zip_code in self.checkpoint_outputs:
+            self.checkpoint_outputs[zip_code].extend(properties)
+        self.add_properties(zip_code, properties)
+
+    def report_duplicates(self, zip_code):
+        duplicates = self.seen_properties.duplicates.get(zip_code, 0)
+        if duplicates:
+            print('Dropped {} duplicate listings for {}'.format(
+                duplicates, zip_code))
+
+    def complete_zip_code(self, zip_code):
+        """ Every page of zip_code went through add_unique_properties """
+        self.report_duplicates(zip_code)
+        downloader = self.downloaders.pop(zip_code)
+        if self.snapshot_diff is not None:
+            removed = self.snapshot_diff.finish(
+                zip_code, complete=downloader.is_complete)
+            self.output_properties(zip_code, removed)
+            print('Changes for {zip_code}: {new} new, {price_changed} price '
+                  'changed, {status_changed} status changed, {removed} '
+                  'removed, {unchanged} unchanged'.format(
+                      zip_code=zip_code,
+                      **self.snapshot_diff.counts[zip_code]))
+        self.finish_zip_code(zip_code)
+        output = self.checkpoint_outputs.pop(zip_code, None)
+        if output is not None and not downloader.failed_pages:
+            # zip codes with failed pages are fetched again when resuming
+            self.checkpoints.finish(zip_code, output)
+            self.finished_checkpoints.append(zip_code)
+
+    def open_checkpoint(self, zip_code):
+        """ Checkpoint to resume zip_code from, None to scrape it from
+        scratch. Only called for zip codes scraped as a whole. """
+        if self.checkpoints is None:
+            return None
+        self.checkpoint_outputs[zip_code] = []
+        if not self.resume:
+            self.checkpoints.clear(zip_code)
+            return None
+        return self.checkpoints.load(zip_code)
+
+    def replay_finished(self, zip_code, checkpoint):
+        """ Hand the output of a finished zip code to the sink again """
+        print('Resuming {}: already finished with {} listings'.format(
+            zip_code, len(checkpoint.output)))
+        self.checkpoint_outputs.pop(zip_code, None)
+        self.add_properties(
+            zip_code, self.seen_properties.filter(checkpoint.output, zip_code))
+        self.finish_zip_code(zip_code)
+        self.finished_checkpoints.append(zip_code)
+
+    def resume_pages(self, zquery, zip_code, checkpoint):
+        """ Replays the checkpointed pages of zip_code, returns an iterator
+        over the (page number, ZillowResultsPage) still to fetch """
+        if checkpoint is None or checkpoint.page_urls is None:
+            return zquery.iter_pages()
+        print('Resuming {}: {} of {} pages checkpointed'.format(
+            zip_code, len(checkpoint.pages), len(checkpoint.page_urls) + 1))
+        zquery.page_urls = checkpoint.page_urls
+        for page in sorted(checkpoint.pages):
+            self.add_unique_properties(zip_code, checkpoint.pages[page])
+        return zquery.iter_page_urls(checkpoint.remaining())
+
+    def clear_checkpoints(self):
+        """ The output is written, only unfinished zip codes are kept """
+        for zip_code in self.finished_checkpoints:
+            self.checkpoints.clear(zip_code)
+        self.finished_checkpoints = []
+
+    def finish_zip_code(self, zip_code):
+        """ Called once all pages of a zip code have been handed over """
+        self.zip_code = zip_code
+        self.add_data_to_csv(self.pending_properties.pop(zip_code, []))
+
+    def get_limiter(self, url):
+        """ The rate limiter of the host of url, shared by every zip code so
+        --zip-workers doesn't multiply the request rate """
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = TokenBucket(
+                rate=self.rate, capacity=self.concurrency, jitter=self.jitter)
+        return self.limiters[host]
+
+    def create_downloader(self, tr, zip_code):
+        return ZillowHtmlDownloader(tr, zip_code,
+                                    verbose=self.verbose,
+                                    concurrency=self.concurrency,
+                                    retry_policy=self.retry_policy,
+                                    newest_first=self.since_last,
+                                    limiter=self.get_limiter(ZILLOW_URL))
+
+    def report_retries(self):
+        print('Used {} of {} retries, {} tor identity resets'.format(
+            self.retry_policy.retries,
+            self.retry_policy.budget,
+            self.retry_policy.rotations))
+
+    def create_client(self):
+        tr = create_client_pool() or get_tor_client()
+        if self.cache_ttl > 0:
+            tr = CachedFetcher(
+                tr, ResponseCache(path=self.cache_path, ttl=self.cache_ttl))
+        return tr
+
+    def report_fetch_stats(self, tr):
+        print_connection_stats(tr)
+        print_cache_stats(tr)
+        print_circuit_stats(tr)
+        self.report_retries()
+
+    def start_run(self):
+        """ Sets up the state shared by a whole run, returns the http client """
+        tr = self.create_client()
+        # one retry budget for the whole job
+        self.retry_policy = RetryPolicy(budget=self.retry_budget,
+                                        rotate_identity=self.rotate_identity)
+        if self.since_last:
+            self.snapshot_diff = SnapshotDiff(SnapshotStore(self.snapshot_path))
+        return tr
+
+    def probe_zip_code(self, zip_code):
+        """ Fetch only the first page of zip_code
+
+        Returns (properties of the first page, (page, url) pairs of the
+        remaining pages) so the rest can be planned or split across jobs.
+        """
+        tr = self.start_run()
+        zquery = self.create_downloader(tr, zip_code)
+        first_page, page_urls = zquery.fetch_first_page()
+        if first_page is None:
+            raise Exception(
+                'Failed to fetch the first page for {}'.format(zip_code))
+        return self.parse_properties(first_page), page_urls
+
+    def scrape_pages(self, zip_code, page_urls):
+        """ Scrape only the given (page, url) pairs of zip_code and hand them
+        to the sink, returns the pages that failed """
+        tr = self.start_run()
+        self.zip_code = zip_code
+        zquery = self.create_downloader(tr, zip_code)
+        self.start_zip_code(zip_code, zquery)
+        for page, result in zquery.iter_page_urls(page_urls):
+            print('Parsing page {}'.format(page))
+            self.add_page(zip_code, page, self.parse_properties(result))
+        failed_pages = dict(zquery.failed_pages)
+        self.complete_zip_code(zip_code)
+        self.report_fetch_stats(tr)
+        self.write_csv()
+        return failed_pages
+
     def scrape(self):
-        tr = get_tor_client()
+        tr = self.start_run()
+        if self.zip_workers > 1 and len(self.zip_codes) > 1:
+            self.scrape_parallel(tr)
+            return
         for zip_code in self.zip_codes:
-            results_pages = []
             self.zip_code = zip_code
-            zquery = ZillowHtmlDownloader(tr, zip_code, verbose=self.verbose)
-            results_pages.extend(zquery.query_zillow())
-
-            properties_list = []
-            for i, result in enumerate(results_pages):
+            checkpoint = self.open_checkpoint(zip_code)
+            if checkpoint is not None and checkpoint.is_finished:
+                self.replay_finished(zip_code, checkpoint)
+                continue
+            zquery = self.create_downloader(tr, zip_code)
+            self.start_zip_code(zip_code, zquery)
+            pages = self.resume_pages(zquery, zip_code, checkpoint)
+            for page, result in pages:
                 try:
-                    print('Parsing page {}'.format(i + 1))
-                    properties_list.extend(self.parse_properties(result))
+                    print('Parsing page {}'.format(page))
+                    self.add_page(
+                        zip_code, page, self.parse_properties(result))
                 except BaseException:
-                    print(result)
+                    print(result.text)
                     raise
-            self.add_data_to_csv(properties_list)
+            if 1 in zquery.failed_pages:
+                raise Exception(
+                    'Failed to fetch the first page for {}'.format(zip_code))
+            self.complete_zip_code(zip_code)
+        self.report_fetch_stats(tr)
         self.write_csv()
+        if self.checkpoints is not None:
+            self.clear_checkpoints()
 
+    def export(self, properties_by_zip):
+        """ Send already parsed properties to the sink without scraping
+        properties_by_zip: zip code -> list of properties, in output order
+        """
+        for zip_code, properties in properties_by_zip.items():
+            self.add_properties(zip_code, properties)
+            self.finish_zip_code(zip_code)
+        self.write_csv()
 
-INFO = """\
-Here are your Zillow results for {}
-
-Results are provided by Engineered Cash Flow LLC
-Please support us by following us:
-https://www.facebook.com/engineeredcashflow
-https://www.instagram.com/engineeredcashflow
-https://www.engineeredcashflow.com
-
-Disclaimer:
-
-All investments, including real estate, are highly speculative in nature and
-involve substantial risk of loss. We encourage our investors to invest very
-carefully. We also encourage investors to get personal advice from your
-professional investment advisor and to make independent investigations before
-acting on information that we publish. Much of our information is derived
-directly from information published by companies or submitted to governmental
-agencies on which we believe are reliable but are without our independent verification.
-Therefore, we cannot assure you that the information is accurate or complete.
-We do not in any way whatsoever warrant or guarantee the success of any action
-you take in reliance on our statements or recommendations.
-"""
-
-
-class ZillowScraperGsheets(ZillowScraper):
-    GSHEETS_SCOPE = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/spreadsheets',
-        'https://www.googleapis.com/auth/drive.file',
-        'https://www.googleapis.com/auth/drive']
-
-    def __init__(self, zip_codes, share_email, verbose=False):
-        super(ZillowScraperGsheets, self).__init__(zip_codes=zip_codes,
-                                                   verbose=verbose)
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(
-            CREDENTIALS, scopes=self.GSHEETS_SCOPE)
-        self.client = gspread.authorize(creds)
-        self.share_email = share_email
-        self.sheet = None
-
-    def create_disclaimer_worksheet(self, sheet):
-        worksheet = sheet.get_worksheet(0)
-        worksheet.update_title('Info')
-        disclaimer = INFO.format(self.zip_code).splitlines()
-        disclaimer_cells = worksheet.range(1, 1, len(disclaimer), 1)
-        for i, line in enumerate(disclaimer):
-            disclaimer_cells[i].value = line
-        worksheet.update_cells(disclaimer_cells)
-
-        fmt = gsf.cellFormat(
-            backgroundColor=gsf.color(0.7, 0.77, 0.87),
-            textFormat=gsf.textFormat(
-                bold=True,
-                foregroundColor=gsf.color(0, 0, .54)),
-            horizontalAlignment='LEFT')
-        gsf.format_cell_ranges(worksheet, [('A1:E1', fmt),
-                                           ('A3:E3', fmt),
-                                           ('A4:E4', fmt),
-                                           ('A9:E9', fmt)])
-
-    def create_data_worksheet(self, sheet, rows, cols, properties_list):
-        worksheet = sheet.add_worksheet(
-            title=self.zip_code,
-            rows=str(rows),
-            cols=str(cols))
-        worksheet.clear()
-        cell_list = worksheet.range(1, 1, rows, cols)
-        cell_values = [
-            'Provided to you by Engineered Cash Flow LLC, https://www.engineeredcashflow.com']
-        cell_values.extend([''] * (cols - 1))
-        cell_values.extend(self.fieldnames)
-
-        for p in tqdm(properties_list):
-            data = []
-            for field in self.fieldnames:
-                data.append(p.__dict__[field])
-            cell_values.extend(data)
-
-        assert len(cell_values) == len(cell_list), 'Cell/value mismatch'
-
-        for i, val in enumerate(cell_values):
-            cell_list[i].value = val
-        worksheet.update_cells(cell_list)
-
-        fmt_title = gsf.cellFormat(
-            backgroundColor=gsf.color(0.7, 0.77, 0.87),
-            textFormat=gsf.textFormat(
-                bold=True,
-                foregroundColor=gsf.color(0, 0, .54)),
-            horizontalAlignment='LEFT')
-        fmt_fields = gsf.cellFormat(
-            backgroundColor=gsf.color(0.7, 0.77, 0.87),
-            textFormat=gsf.textFormat(
-                bold=True,
-                foregroundColor=gsf.color(0, 0, .54)),
-            horizontalAlignment='CENTER')
-        # hack since gspread_formatting doesn't seem to support
-        # full row notation (e.g. '1:2')
-        col_label = chr(ord('a') + cols).upper()
-        gsf.format_cell_ranges(worksheet, [
-            ('A1:{}1'.format(col_label), fmt_title),
-            ('A2:{}2'.format(col_label), fmt_fields)])
+    def stream_zip_code(self, zquery, pages, zip_code, parsers, parse_slots,
+                        events):
+        """ Download thread body for scrape_parallel, hands each of pages to
+        the parser pool as soon as it arrives """
+        submitted = 0
+        for page, result in pages:
+            if result.is_parsed:
+                # the tree is already built, don't parse it again in the pool
+                future = Future()
+                future.set_result(parse_properties(result, self.verbose))
+                events.put(('parse', zip_code, page, future))
+                submitted += 1
+                continue
+            parse_slots.acquire()
+            future = parsers.submit(
+                parse_properties, result.text, self.verbose)
+            future.add_done_callback(
+                lambda f, page=page: (
+                    parse_slots.release(),
+                    events.put(('parse', zip_code, page, f))))
+            submitted += 1
+        if 1 in zquery.failed_pages:
+            raise Exception('Failed to fetch the first page')
+        return submitted
+
+    def scrape_parallel(self, tr):
+        """ Download zip codes concurrently and parse pages in a process pool
+
+        Pages are parsed as they arrive and their properties are handed to
+        the sink straight away, zip codes are finished in the order they
+        complete. A failure in one zip code is recorded in failed_zip_codes
+        and does not stop the others.
+        """
+        self.failed_zip_codes = {}
+        events = queue.Queue()
+        # zip code -> [pages submitted or None while downloading, pages parsed]
+        progress = {zip_code: [None, 0] for zip_code in self.zip_codes}
+        completed = 0
+
+        def fail(zip_code, stage, error):
+            if zip_code not in self.failed_zip_codes:
+                self.failed_zip_codes[zip_code] = '{} failed: {}'.format(
+                    stage, error)
+                print('Zip code {} {} failed: {}'.format(
+                    zip_code, stage, error))
+            progress.pop(zip_code, None)
+            self.pending_properties.pop(zip_code, None)
+            self.downloaders.pop(zip_code, None)
+            self.checkpoint_outputs.pop(zip_code, None)
+
+        # parser processes are started from the download threads, a plain
+        # fork there can copy a libxml2 lock held by another thread
+        with ThreadPoolExecutor(max_workers=self.zip_workers) as downloaders, \
+                ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context(
+                        'forkserver')) as parsers:
+            # bound the pages waiting in the parser pool
+            parse_slots = threading.BoundedSemaphore(
+                (self.parse_workers or os.cpu_count() or 1) * 2)
+            for zip_code in self.zip_codes:
+                checkpoint = self.open_checkpoint(zip_code)
+                if checkpoint is not None and checkpoint.is_finished:
+                    self.replay_finished(zip_code, checkpoint)
+                    progress.pop(zip_code)
+                    completed += 1
+                    continue
+                zquery = self.create_downloader(tr, zip_code)
+                self.start_zip_code(zip_code, zquery)
+                pages = self.resume_pages(zquery, zip_code, checkpoint)
+                future = downloaders.submit(
+                    self.stream_zip_code, zquery, pages, zip_code, parsers,
+                    parse_slots, events)
+                future.add_done_callback(
+                    lambda f, zip_code=zip_code: events.put(
+                        ('download', zip_code, None, f)))
+
+            while progress:
+                stage, zip_code, page, future = events.get()
+                if zip_code not in progress:
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    fail(zip_code, stage, e)
+                    continue
+
+                if stage == 'download':
+                    progress[zip_code][0] = result
+                else:
+                    progress[zip_code][1] += 1
+                    try:
+                        self.add_page(zip_code, page, result)
+                    except Exception as e:
+                        fail(zip_code, 'upload', e)
+                        continue
+
+                submitted, parsed = progress[zip_code]
+                if submitted is None or parsed < submitted:
+                    continue
+                try:
+                    self.complete_zip_code(zip_code)
+                except Exception as e:
+                    fail(zip_code, 'upload', e)
+                    continue
+                progress.pop(zip_code)
+                completed += 1
+
+        for zip_code in sorted(self.failed_zip_codes):
+            print('Failed zip code {}: {}'.format(
+                zip_code, self.failed_zip_codes[zip_code]))
+        self.report_fetch_stats(tr)
+        if completed == 0:
+            raise Exception('All zip codes failed: {}'.format(
+                ', '.join(sorted(self.failed_zip_codes))))
+        self.write_csv()
+        if self.checkpoints is not None:
+            self.clear_checkpoints()
 
-    def add_data_to_csv(self, properties_list):
-        if self.sheet is None:
-            sheetname = 'zillow_data_{}_{}'.format(
-                datetime.datetime.now().strftime('%m_%d_%Y__%H_%M_%S'), '_'.join(self.zip_codes))
-            self.sheet = self.client.create(sheetname)
-            self.create_disclaimer_worksheet(self.sheet)
 
-        rows = len(properties_list) + 2  # title + fieldnames
-        cols = len(self.fieldnames)
-        self.create_data_worksheet(self.sheet, rows, cols, properties_list)
+class ZillowScraperCsv(ZillowScraper):
+    """ Writes properties to local files as soon as each page is parsed
+
+    output_format: csv, csv.gz, ndjson or parquet
+    layout: single file for the run, one file per zip code, or a dataset
+        partitioned by the searched zip code
+    append: add to the files of earlier runs instead of new timestamped ones
+    """
+
+    def __init__(self, zip_codes, outdir, verbose=False, output_format='csv',
+                 layout='single', append=False, **kwargs):
+        super(ZillowScraperCsv, self).__init__(zip_codes=zip_codes,
+                                               verbose=verbose,
+                                               **kwargs)
+        assert output_format in WRITERS, 'unknown format {}'.format(
+            output_format)
+        assert layout in LAYOUTS, 'unknown layout {}'.format(layout)
+        self.outdir = outdir
+        self.output_format = output_format
+        self.layout = layout
+        self.append = append
+        self.writers = {}
+        self.rows_written = 0
+
+    def get_writer(self, zip_code):
+        label = self.zip_codes[-1] if self.layout == 'single' else zip_code
+        writer = self.writers.get(label)
+        if writer is None:
+            filename = output_path(self.outdir, self.output_format,
+                                   self.layout, label, self.append)
+            print('Saving to {}'.format(filename))
+            writer = open_writer(self.output_format, filename, self.fieldnames,
+                                 self.append and self.layout != 'partitioned')
+            self.writers[label] = writer
+        return writer
+
+    def close_writer(self, label):
+        writer = self.writers.pop(label, None)
+        if writer is not None:
+            writer.close()
+
+    @timed('sink_add')
+    def add_properties(self, zip_code, properties):
+        self.get_writer(zip_code).write(properties)
+        self.rows_written += len(properties)
+
+    def finish_zip_code(self, zip_code):
+        self.zip_code = zip_code
+        if self.layout != 'single':
+            # per zip files are done, don't keep them open
+            self.close_writer(zip_code)
+
+    def add_data_to_csv(self, properties_list):
+        self.add_properties(self.zip_code, properties_list)
 
+    @timed('sink_write')
     def write_csv(self):
-        print('Sharing with {}'.format(self.share_email))
-        self.sheet.share(
-            self.share_email,
-            perm_type='user',
-            role='owner' if self.share_email.endswith(
-                '@gmail.com') else 'writer',
-            notify=True,
-            email_message='Here is your zip_code list from Engineered Cash Flow',
-            with_link=False)
-        self.sheet = None
+        if not self.writers and self.layout == 'single':
+            self.get_writer(self.zip_code)
+        for label in list(self.writers):
+            self.close_writer(label)
+        print('Saved {} properties'.format(self.rows_written))
 
 
-class ZillowScraperCsv(ZillowScraper):
+class ZillowScraperMemory(ZillowScraper):
+    """ Keeps the parsed properties of every zip code in results """
 
-    def __init__(self, zip_codes, outdir, verbose=False):
-        super(ZillowScraperCsv, self).__init__(zip_codes=zip_codes,
-                                               verbose=verbose)
-        self.outdir = outdir
-        self.properties_list = []
+    def __init__(self, zip_codes, verbose=False, **kwargs):
+        super(ZillowScraperMemory, self).__init__(zip_codes=zip_codes,
+                                                  verbose=verbose,
+                                                  **kwargs)
+        self.results = {}
 
     def add_data_to_csv(self, properties_list):
-        # for this option, we save all zips in the same csv
-        self.properties_list.extend(properties_list)
+        self.results[self.zip_code] = properties_list
 
     def write_csv(self):
-        fieldnames = [
-            'title',
-            'address',
-            'days_on_zillow',
-            'city',
-            'state',
-            'postal_code',
-            'price',
-            'info',
-            'broker',
-            'property_url']
-        name = 'zillow_data_{}_{}.csv'.format(
-            datetime.datetime.now().strftime('%m_%d_%Y__%H_%M_%S'), self.zip_code)
-        filename = os.path.join(self.outdir, name)
-        print('Saving to {}'.format(filename))
-        with open(filename, 'wb') as csvfile:
-            writer = unicodecsv.DictWriter(csvfile, fieldnames=self.fieldnames)
-            writer.writeheader()
-            print('Saving {} properties'.format(len(self.properties_list)))
-            for p in self.properties_list:
-                data = {}
-                for field in self.fieldnames:
-                    data[field] = p.__dict__[field]
-                writer.writerow(data)
+        pass
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.cache import CachedFetcher, ResponseCache
+from src.zillow_scraper import ZillowHtmlDownloader
+
+URL = 'https://www.zillow.com/homes/12345_rb/'
+
+
+class Response(object):
+    def __init__(self, text):
+        self.text = text
+        self.status_code = 200
+        self.headers = {}
+
+
+class CountingFetcher(object):
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.urls.append(url)
+        return Response('<html>{}</html>'.format(len(self.urls)))
+
+
+class CountingLimiter(object):
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return 0.0
+
+
+class CachedRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ResponseCache(path=os.path.join(self.tmp, 'cache'))
+        self.fetcher = CountingFetcher()
+        self.limiter = CountingLimiter()
+        self.downloader = ZillowHtmlDownloader(
+            CachedFetcher(self.fetcher, self.cache), '12345',
+            limiter=self.limiter)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+
+    def test_fresh_page_skips_the_rate_limiter(self):
+        self.assertEqual(self.downloader.request(URL).text, '<html>1</html>')
+        self.assertEqual(self.downloader.request(URL).text, '<html>1</html>')
+        self.assertEqual(len(self.fetcher.urls), 1)
+        self.assertEqual(self.limiter.acquired, 1)
+
+    def test_stale_page_waits_for_the_rate_limiter(self):
+        self.downloader.request(URL)
+        self.cache.ttl = 0
+        self.assertIsNone(self.downloader.tor.peek(URL))
+        self.downloader.request(URL)
+        self.assertEqual(len(self.fetcher.urls), 2)
+        self.assertEqual(self.limiter.acquired, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
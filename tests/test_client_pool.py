@@ -0,0 +1,97 @@
+import contextlib
+import io
+import requests
+import unittest
+
+from src.client_pool import ClientPool
+from src.util import CAPTCHA_TEXT
+
+
+class FakeResponse(object):
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+
+class FakeClient(object):
+    """ Stands in for a proxy or tor circuit, answers with text or raises
+    error, and counts its requests and identity resets """
+
+    def __init__(self, text='results', error=None):
+        self.text = text
+        self.error = error
+        self.requests = 0
+        self.resets = 0
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests += 1
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(self.text)
+
+    def reset_identity(self):
+        self.resets += 1
+        return True
+
+
+class ClientPoolTest(unittest.TestCase):
+
+    def get(self, pool, url='https://www.zillow.com/x'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return pool.get(url)
+
+    def test_round_robin_rotates_circuits(self):
+        clients = [FakeClient() for _ in range(3)]
+        pool = ClientPool(
+            [(str(i), client) for i, client in enumerate(clients)],
+            strategy='round-robin')
+        for _ in range(6):
+            self.get(pool)
+        self.assertEqual([client.requests for client in clients], [2, 2, 2])
+
+    def test_captcha_quarantines_and_retries_elsewhere(self):
+        captcha = FakeClient(text=CAPTCHA_TEXT)
+        good = FakeClient()
+        pool = ClientPool([('captcha', captcha), ('good', good)],
+                          strategy='round-robin', quarantine=300)
+        for _ in range(4):
+            self.assertEqual(self.get(pool).text, 'results')
+        self.assertEqual(captcha.requests, 1)
+        self.assertEqual(captcha.resets, 1)
+        self.assertEqual(good.requests, 4)
+        stats = pool.circuit_stats()
+        self.assertTrue(stats['captcha']['quarantined'])
+        self.assertEqual(stats['captcha']['captchas'], 1)
+        self.assertFalse(stats['good']['quarantined'])
+
+    def test_connection_error_moves_to_next_circuit(self):
+        broken = FakeClient(error=requests.ConnectionError('refused'))
+        good = FakeClient()
+        pool = ClientPool([('broken', broken), ('good', good)],
+                          strategy='round-robin')
+        for _ in range(2):
+            self.assertEqual(self.get(pool).text, 'results')
+        stats = pool.circuit_stats()
+        self.assertEqual(stats['broken']['failures'], broken.requests)
+        self.assertEqual(stats['good']['successes'], 2)
+        self.assertLess(pool.circuits[0].health, pool.circuits[1].health)
+
+    def test_every_circuit_failing_raises(self):
+        pool = ClientPool(
+            [(str(i), FakeClient(error=requests.ConnectionError('refused')))
+             for i in range(2)])
+        with self.assertRaises(requests.ConnectionError):
+            self.get(pool)
+
+    def test_every_circuit_quarantined(self):
+        pool = ClientPool([(str(i), FakeClient(text=CAPTCHA_TEXT))
+                           for i in range(2)], quarantine=300)
+        # the last captcha page is handed back for get_response to retry
+        self.assertIn(CAPTCHA_TEXT, self.get(pool).text)
+        with self.assertRaises(requests.ConnectionError):
+            self.get(pool)
+        self.assertIsNone(pool.pick())
+
+
+if __name__ == '__main__':
+    unittest.main()
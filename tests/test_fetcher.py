@@ -0,0 +1,56 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from src.fetcher import HttpFetcher
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Answers every GET, as a server and as a forward http proxy """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConnectionStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.address = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, fetcher, url, count=5):
+        for _ in range(count):
+            self.assertEqual(fetcher.get(url).text, 'ok')
+        stats = fetcher.connection_stats()['total']
+        fetcher.close()
+        return stats
+
+    def test_direct(self):
+        stats = self.fetch(HttpFetcher(), self.address + '/page')
+        self.assertEqual(stats, {'requests': 5, 'connections': 1,
+                                 'reused': 4})
+
+    def test_proxied(self):
+        fetcher = HttpFetcher(proxies={'http': self.address})
+        stats = self.fetch(fetcher, 'http://zillow.test/page')
+        self.assertEqual(stats, {'requests': 5, 'connections': 1,
+                                 'reused': 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import contextlib
+import io
+import unittest
+
+from benchmarks.bench_properties import make_listing
+from src.gsheets import ZillowScraperGsheets
+from src.properties import ZillowPropertyJson
+from src.sheets_batch import SheetsBatch
+
+
+class StubSheet(object):
+    """ Stands in for a gspread Spreadsheet """
+
+    def __init__(self, title):
+        self.title = title
+        self.batch_updates = []
+        self.shared_with = []
+
+    def batch_update(self, body):
+        self.batch_updates.append(body)
+
+    def share(self, email, **kwargs):
+        self.shared_with.append(email)
+
+
+class StubClient(object):
+    """ Stands in for a gspread Client """
+
+    def __init__(self):
+        self.sheets = []
+
+    def create(self, title):
+        sheet = StubSheet(title)
+        self.sheets.append(sheet)
+        return sheet
+
+
+def request_kinds(body):
+    return [list(request)[0] for request in body['requests']]
+
+
+class SheetsBatchTest(unittest.TestCase):
+
+    def test_data_sheet(self):
+        batch = SheetsBatch()
+        sheet_id = batch.add_data_sheet(
+            '10001', 'header', ['address', 'price'],
+            [['1 Main St', 100], ['2 Main St', None]])
+        self.assertEqual(sheet_id, 1)
+        self.assertEqual(request_kinds(batch.body()),
+                         ['addSheet', 'updateCells', 'repeatCell',
+                          'repeatCell'])
+        rows = batch.requests[1]['updateCells']['rows']
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[2]['values'][1],
+                         {'userEnteredValue': {'numberValue': 100}})
+        self.assertEqual(rows[3]['values'][1], {})
+
+
+class ZillowScraperGsheetsTest(unittest.TestCase):
+
+    def export(self, client, properties_by_zip):
+        zsearch = ZillowScraperGsheets(list(properties_by_zip),
+                                       'someone@example.com', client=client)
+        with contextlib.redirect_stdout(io.StringIO()):
+            zsearch.export(properties_by_zip)
+        return zsearch
+
+    def test_one_batch_update_per_export(self):
+        client = StubClient()
+        properties = [ZillowPropertyJson(make_listing(i)) for i in range(5)]
+        zsearch = self.export(client, {'10001': properties[:3],
+                                       '10002': properties[3:]})
+        self.assertEqual(len(client.sheets), 1)
+        sheet = client.sheets[0]
+        self.assertEqual(len(sheet.batch_updates), 1)
+        self.assertEqual(sheet.shared_with, ['someone@example.com'])
+        kinds = request_kinds(sheet.batch_updates[0])
+        self.assertEqual(kinds.count('addSheet'), 2)
+        # create, batch_update and share
+        self.assertEqual(zsearch.api_calls, 3)
+
+        self.export(client, {'10003': properties})
+        self.assertEqual(len(client.sheets), 2)
+        self.assertEqual(len(client.sheets[1].batch_updates), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
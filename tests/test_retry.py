@@ -0,0 +1,28 @@
+import unittest
+
+from src.retry import RetryPolicy
+
+
+class Response(object):
+    def __init__(self, retry_after):
+        self.headers = {'Retry-After': retry_after}
+
+
+class RetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(RetryPolicy().retry_after(Response('7')), 7.0)
+
+    def test_past_date(self):
+        self.assertEqual(RetryPolicy().retry_after(
+            Response('Wed, 21 Oct 2015 07:28:00 GMT')), 0.0)
+
+    def test_invalid_value_falls_back_to_backoff(self):
+        policy = RetryPolicy()
+        self.assertIsNone(policy.retry_after(Response('soon')))
+        self.assertLessEqual(policy.delay(0, Response('soon')),
+                             policy.base_delay)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import contextlib
+import faulthandler
+import io
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.bench_scrape import ReplayScraper
+from benchmarks.corpus import generate, load_manifest
+from benchmarks.replay import ReplayFetcher
+
+
+class ScrapeParallelTest(unittest.TestCase):
+    """ scrape_parallel against the generated replay corpus """
+
+    def setUp(self):
+        # a deadlocked parser pool fails the run instead of hanging it
+        faulthandler.dump_traceback_later(120, exit=True)
+        self.corpus_dir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+        generate(self.corpus_dir, 400)
+
+    def tearDown(self):
+        faulthandler.cancel_dump_traceback_later()
+        shutil.rmtree(self.corpus_dir)
+        shutil.rmtree(self.outdir)
+
+    def test_two_zip_workers(self):
+        zip_codes = sorted(load_manifest(self.corpus_dir))
+        fetcher = ReplayFetcher(self.corpus_dir)
+        zsearch = ReplayScraper(fetcher, zip_codes, self.outdir,
+                                concurrency=2, rate=1000.0, jitter=0.0,
+                                zip_workers=2, parse_workers=2, cache_ttl=0)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            zsearch.scrape()
+        self.assertEqual(zsearch.failed_zip_codes, {})
+        self.assertEqual(zsearch.rows_written, 400 * len(zip_codes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.bench_scrape import ReplayScraper
+from benchmarks.corpus import generate, load_manifest
+from benchmarks.replay import ReplayFetcher
+from src.sinks import import_pyarrow
+
+pyarrow = import_pyarrow()
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class PartitionedParquetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus_dir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+        generate(self.corpus_dir, 80)
+
+    def tearDown(self):
+        shutil.rmtree(self.corpus_dir)
+        shutil.rmtree(self.outdir)
+
+    def test_dataset_reads_back(self):
+        zip_codes = sorted(load_manifest(self.corpus_dir))
+        for _ in range(2):
+            zsearch = ReplayScraper(ReplayFetcher(self.corpus_dir), zip_codes,
+                                    self.outdir, rate=1000.0, jitter=0.0,
+                                    cache_ttl=0, output_format='parquet',
+                                    layout='partitioned', append=True)
+            with contextlib.redirect_stdout(io.StringIO()), \
+                    contextlib.redirect_stderr(io.StringIO()):
+                zsearch.scrape()
+        table = pyarrow.parquet.read_table(
+            os.path.join(self.outdir, 'zillow_data'))
+        self.assertEqual(table.num_rows, 2 * 80 * len(zip_codes))
+        searched = set(table.column('zip_code').to_pylist())
+        self.assertEqual(sorted(str(zip_code) for zip_code in searched),
+                         zip_codes)
+
+
+if __name__ == '__main__':
+    unittest.main()
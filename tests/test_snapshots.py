@@ -0,0 +1,35 @@
+import unittest
+
+from src.snapshots import SnapshotDiff, SnapshotStore
+
+
+class FullScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SnapshotStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def scan(self, interval, complete):
+        diff = SnapshotDiff(self.store, full_scan_interval=interval)
+        diff.start('12345')
+        needs_full_scan = diff.needs_full_scan('12345')
+        diff.finish('12345', complete=complete)
+        return needs_full_scan
+
+    def test_first_run_is_a_full_scan(self):
+        self.assertTrue(self.scan(3600, complete=True))
+        self.assertFalse(self.scan(3600, complete=False))
+
+    def test_incomplete_scan_is_not_recorded(self):
+        self.scan(3600, complete=False)
+        self.assertTrue(self.scan(3600, complete=True))
+
+    def test_full_scan_due_after_interval(self):
+        self.scan(3600, complete=True)
+        self.assertTrue(self.scan(0, complete=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
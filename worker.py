@@ -1,6 +1,18 @@
+""" RQ worker entry point
+
+With WORKER_PROCESSES > 1 a supervisor runs that many worker processes,
+restarts the ones that crash and recycles a worker after WORKER_MAX_JOBS jobs
+or once it uses more than WORKER_MAX_MEMORY_MB, which bounds the memory lxml
+keeps around. Fetch settings (tor, pool sizes, rates, ...) come from the
+environment, so every child uses the same ones.
+"""
+import multiprocessing
 import os
 import redis
+import resource
 import rq
+import signal
+import time
 
 listen = ['high', 'default', 'low']
 
@@ -8,7 +20,151 @@ redis_url = os.getenv('REDISTOGO_URL', 'redis://localhost:6379')
 
 connection = redis.from_url(redis_url)
 
-if __name__ == '__main__':
-    with rq.Connection(connection):
-        worker = rq.Worker(map(rq.Queue, listen))
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
+# 0 disables the limit
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', 0))
+WORKER_MAX_MEMORY_MB = int(os.getenv('WORKER_MAX_MEMORY_MB', 0))
+# seconds the supervisor waits for running jobs on shutdown
+WORKER_SHUTDOWN_TIMEOUT = int(os.getenv('WORKER_SHUTDOWN_TIMEOUT', 25))
+# restarts of a crashing child are spaced out up to this many seconds
+MAX_RESTART_DELAY = 30
+# a second stop signal this soon after the first is the same shutdown, sent
+# both by the platform and by the supervisor
+DUPLICATE_SIGNAL_WINDOW = 5
+
+
+def memory_mb():
+    """ Resident memory of this process and its largest work horse """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        rss = pages * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, OSError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    horse = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    return max(rss, horse)
+
+
+class RecyclingWorker(rq.Worker):
+    """ Stops after max_jobs jobs or above max_memory_mb so it can be
+    replaced by a fresh process """
+
+    def __init__(self, *args, **kwargs):
+        self.max_jobs = kwargs.pop('max_jobs', 0)
+        self.max_memory_mb = kwargs.pop('max_memory_mb', 0)
+        self.jobs_done = 0
+        self.stop_requested_at = 0
+        super(RecyclingWorker, self).__init__(*args, **kwargs)
+
+    def request_stop(self, signum, frame):
+        self.stop_requested_at = time.time()
+        super(RecyclingWorker, self).request_stop(signum, frame)
+
+    def request_force_stop(self, signum, frame):
+        if time.time() - self.stop_requested_at < DUPLICATE_SIGNAL_WINDOW:
+            return
+        super(RecyclingWorker, self).request_force_stop(signum, frame)
+
+    def execute_job(self, job, queue):
+        super(RecyclingWorker, self).execute_job(job, queue)
+        self.jobs_done += 1
+        if self.max_jobs and self.jobs_done >= self.max_jobs:
+            print('Worker {} did {} jobs, recycling'.format(
+                os.getpid(), self.jobs_done))
+            self._stop_requested = True
+        elif self.max_memory_mb and memory_mb() > self.max_memory_mb:
+            print('Worker {} uses more than {} MB, recycling'.format(
+                os.getpid(), self.max_memory_mb))
+            self._stop_requested = True
+
+
+def run_worker(max_jobs=WORKER_MAX_JOBS, max_memory_mb=WORKER_MAX_MEMORY_MB):
+    # a connection of our own, never one inherited from the supervisor
+    child_connection = redis.from_url(redis_url)
+    with rq.Connection(child_connection):
+        worker = RecyclingWorker(map(rq.Queue, listen),
+                                 max_jobs=max_jobs,
+                                 max_memory_mb=max_memory_mb)
         worker.work()
+
+
+class Supervisor(object):
+    """ Keeps a number of worker processes running until told to stop """
+
+    def __init__(self, processes=WORKER_PROCESSES,
+                 shutdown_timeout=WORKER_SHUTDOWN_TIMEOUT):
+        self.processes = processes
+        self.shutdown_timeout = shutdown_timeout
+        self.children = {}
+        self.failures = {}
+        self.restart_at = {}
+        self.stopping = False
+
+    def start_child(self, slot):
+        child = multiprocessing.Process(target=run_worker,
+                                        name='worker-{}'.format(slot))
+        child.start()
+        self.children[slot] = child
+        print('Started worker {} (pid {})'.format(slot, child.pid))
+
+    def request_stop(self, signum, frame):
+        if self.stopping:
+            return
+        print('Stopping {} workers'.format(len(self.children)))
+        self.stopping = True
+        for child in self.children.values():
+            if child is not None and child.is_alive():
+                # rq finishes the current job on the first SIGTERM
+                os.kill(child.pid, signal.SIGTERM)
+
+    def check_children(self):
+        now = time.time()
+        for slot, child in list(self.children.items()):
+            if child is None:
+                if now >= self.restart_at[slot]:
+                    self.start_child(slot)
+                continue
+            if child.is_alive():
+                continue
+            child.join()
+            self.children[slot] = None
+            if child.exitcode == 0:
+                # recycled after max jobs or memory
+                self.failures[slot] = 0
+                self.restart_at[slot] = now
+            else:
+                self.failures[slot] = self.failures.get(slot, 0) + 1
+                delay = min(MAX_RESTART_DELAY, 2 ** self.failures[slot])
+                print('Worker {} exited with {}, restarting in {}s'.format(
+                    slot, child.exitcode, delay))
+                self.restart_at[slot] = now + delay
+
+    def shutdown(self):
+        children = [child for child in self.children.values()
+                    if child is not None]
+        deadline = time.time() + self.shutdown_timeout
+        for child in children:
+            child.join(max(0, deadline - time.time()))
+        for child in children:
+            if child.is_alive():
+                print('Killing worker pid {}'.format(child.pid))
+                child.kill()
+                child.join()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        for slot in range(self.processes):
+            self.start_child(slot)
+        while not self.stopping:
+            self.check_children()
+            time.sleep(1)
+        self.shutdown()
+
+
+if __name__ == '__main__':
+    if WORKER_PROCESSES > 1 or WORKER_MAX_JOBS or WORKER_MAX_MEMORY_MB:
+        # a recycled worker needs someone to start its replacement
+        Supervisor().run()
+    else:
+        run_worker()